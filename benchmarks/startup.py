@@ -0,0 +1,82 @@
+import os
+import ast
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+# Cold start benchmark of the pages
+# The top-level imports of every page are run in a fresh interpreter with -X importtime, the
+# way a new Streamlit worker first executes them, and reported as the wall time of the imports
+# next to the modules costing the most. Deferred imports inside functions are not counted,
+# which is the point: they are paid by the feature that needs them, not by the first paint
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ['Home.py', 'pages/1_Explore.py', 'pages/2_Visualize.py', 'pages/3_Recommend.py']
+
+
+def imports(page):
+
+    # Source of the module level import statements of a page, in order
+
+    with open(os.path.join(REPO, page)) as f:
+        source = f.read()
+    return [ast.get_source_segment(source, node) for node in ast.parse(source).body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+
+def _importtime(stderr):
+
+    # Cumulative microseconds of the modules imported directly by the page, from -X importtime
+
+    res = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            res[name.strip()] = int(cumulative)
+    return res
+
+
+def measure(page, repeat=5):
+
+    # Wall time of the imports of a page over repeat fresh interpreters, and the slowest modules of the last one
+
+    code = 'import time\nbegan = time.perf_counter()\n' + '\n'.join(imports(page)) + '\nprint(time.perf_counter() - began)\n'
+    times, modules = [], {}
+    for _ in range(repeat):
+        done = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO, capture_output=True, text=True)
+        if done.returncode != 0:
+            return {'page': page, 'error': done.stderr.strip().splitlines()[-1] if done.stderr.strip() else 'exit code ' + str(done.returncode)}
+        times.append(float(done.stdout.strip().splitlines()[-1]) * 1000)
+        modules = _importtime(done.stderr)
+    times = np.asarray(times)
+    return {'page': page, 'runs': repeat, 'p50_ms': float(np.percentile(times, 50)), 'max_ms': float(times.max()),
+            'modules': sorted(modules.items(), key=lambda item: -item[1])}
+
+
+def report(results, top=5):
+    lines = [' '.join(h.ljust(24 if i == 0 else 10) for i, h in enumerate(['page', 'p50_ms', 'max_ms', 'slowest imports']))]
+    for r in results:
+        if 'error' in r:
+            lines.append(r['page'].ljust(24) + ' ' + r['error'])
+            continue
+        slowest = ', '.join(name + ' ' + str(round(us / 1000)) + 'ms' for name, us in r['modules'][:top])
+        lines.append(' '.join([r['page'].ljust(24), str(round(r['p50_ms'], 1)).ljust(10), str(round(r['max_ms'], 1)).ljust(10), slowest]))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the module level imports of every page in fresh interpreters.')
+    parser.add_argument('--pages', nargs='*', choices=PAGES, default=PAGES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='slowest imported modules listed per page')
+    parser.add_argument('--save', default=None, help='writes the results as json')
+    args = parser.parse_args()
+
+    results = [measure(page, args.repeat) for page in args.pages]
+    print(report(results, args.top))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'repeat': args.repeat, 'results': results}, f, indent=2)
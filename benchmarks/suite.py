@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+
+# Benchmarks of the hot paths on a synthetic dataset (see benchmarks/synthetic.py)
+# Every case runs in a fresh spawned process inside the dataset root: its setup loads what
+# the page would already hold, then the timed call is repeated and reported as latency
+# percentiles next to the peak RSS of the process. Results can be saved as a baseline and
+# later runs compared against it, failing on latency or memory regressions
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMDB_GENRES = ['Action', 'Drama', 'Comedy', 'Thriller']
+
+
+class StubTMDb:
+
+    # Answers describe() like the TMDb cache, from deterministic fake movies and without any network
+
+    def __init__(self, vocab=20_000, seed=0):
+        self.vocab = vocab
+        self.seed = seed
+
+    def describe(self, title):
+        rng = random.Random(title + str(self.seed))
+        words = ' '.join('w' + str(int(rng.paretovariate(1.1)) % self.vocab) for _ in range(40))
+        movie = {
+            'id': rng.randrange(1, 10 ** 6), 'title': title, 'overview': words,
+            'genres': rng.sample(TMDB_GENRES, 2), 'casts': ['Actor ' + str(rng.randrange(500)) for _ in range(5)],
+            'keywords': ['keyword' + str(rng.randrange(2000)) for _ in range(5)],
+        }
+        return [{'id': movie['id'], 'title': title, 'overview': words}], movie
+
+
+def _recommender(roots=None):
+    from utils import datasets
+    from utils import store
+    from utils import shared
+    from utils import recommend
+    from utils import leaderboard
+    from utils.catalog import Catalog
+
+    roots = roots or shared.roots()
+    try:
+        catalog = Catalog.attach(roots['store'])
+    except FileNotFoundError:
+        catalog = Catalog.load()
+    rec = recommend.Recommender.load(catalog, leaderboard.load(catalog, roots['store'] + '/leaderboards.pkl'), datasets.read('contents'),
+                                     datasets.read('links', ['movieId', 'tmdbId']), datasets.read('genres'),
+                                     lambda: store.load_ratings(root=roots['store']), models=roots['models'], root=roots['store'])
+    rec.tmdb = StubTMDb()
+    return rec
+
+
+def loadRecommender():
+    return lambda rng: _recommender()
+
+
+def loadRecommenderShared():
+
+    # Startup of a worker attaching to artifacts another worker already published
+
+    from utils import shared
+
+    root = os.path.abspath('./shared')
+    os.makedirs(root, exist_ok=True)
+    shared.publish(root)
+    return lambda rng: _recommender(shared.roots(root))
+
+
+def load_data():
+    from utils import store
+    return lambda rng: store.load_ratings()['rating'].to_numpy().sum()
+
+
+def load_data_csv():
+    from utils import store
+    return lambda rng: store.load_ratings(root='./missing')['rating'].to_numpy().sum()
+
+
+def popularMeasureTMDB():
+    from utils import leaderboard
+    from utils.catalog import Catalog
+
+    catalog = Catalog.load()
+    boards = leaderboard.load(catalog)
+    names = list(boards)
+    return lambda rng: catalog.render(leaderboard.sample(boards, rng.choice(names), 5))
+
+
+def contextBasedRecommendations():
+    rec = _recommender()
+    return lambda rng: rec.content('Unknown Movie ' + str(rng.randrange(10 ** 6)), 5)
+
+
+def contextBasedRecommendationsCached():
+    rec = _recommender()
+    titles = ['Popular Movie ' + str(i) for i in range(20)]
+    return lambda rng: rec.content(rng.choice(titles), 5)
+
+
+def contextBasedRecommendationsBatch():
+    rec = _recommender()
+    return lambda rng: rec.content_batch([rec.resolve('Unknown Movie ' + str(rng.randrange(10 ** 6))) for _ in range(32)], 5)
+
+
+def collaborativeBasedRecommendations():
+    rec = _recommender()
+    titles = list(rec.titles)
+    return lambda rng: rec.collaborative(rng.choice(titles), ' '.join(rng.sample(TMDB_GENRES, 2)).lower(), 5)
+
+
+def keySeg():
+    from utils import tokens
+    from utils.catalog import Catalog
+
+    voted = Catalog.load().voted()['tmdbId']
+    return lambda rng: tokens.TokenTable.load('keywords').top(100, voted)
+
+
+def keySegParse():
+    from utils import datasets
+    from utils import tokens
+    return lambda rng: tokens.build('keywords', datasets.read).top(100)
+
+
+def coappearanceGraph():
+    from utils import graph
+    from utils import tokens
+
+    casts = tokens.TokenTable.load('casts')
+    return lambda rng: graph.CoappearanceGraph.from_tokens(casts)
+
+
+CASES = {
+    'load_recommender': loadRecommender,
+    'load_recommender_shared': loadRecommenderShared,
+    'load_data': load_data,
+    'load_data_csv': load_data_csv,
+    'popularMeasureTMDB': popularMeasureTMDB,
+    'contextBasedRecommendations': contextBasedRecommendations,
+    'contextBasedRecommendations_cached': contextBasedRecommendationsCached,
+    'contextBasedRecommendations_batch32': contextBasedRecommendationsBatch,
+    'collaborativeBasedRecommendations': collaborativeBasedRecommendations,
+    'keySeg': keySeg,
+    'keySeg_parse': keySegParse,
+    'coappearance_graph': coappearanceGraph,
+}
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _run(name, root, repeat, warmup, seed, results):
+    sys.path.insert(0, REPO)
+    os.chdir(root)
+    rng = random.Random(seed)
+    began = time.perf_counter()
+    call = CASES[name]()
+    setup = time.perf_counter() - began
+    for _ in range(warmup):
+        call(rng)
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        call(rng)
+        times.append(time.perf_counter() - began)
+    times = np.asarray(times) * 1000
+    results.put({
+        'case': name, 'runs': repeat, 'setup_ms': setup * 1000, 'mean_ms': float(times.mean()),
+        'p50_ms': float(np.percentile(times, 50)), 'p90_ms': float(np.percentile(times, 90)),
+        'p99_ms': float(np.percentile(times, 99)), 'peak_rss_mb': _peak_rss_mb(),
+    })
+
+
+def run(root, cases=None, repeat=20, warmup=2, seed=0):
+
+    # Runs every case in its own spawned process, so the peak RSS is the case's own
+
+    ctx = multiprocessing.get_context('spawn')
+    root = os.path.abspath(root)
+    res = {}
+    for name in cases or CASES:
+        results = ctx.Queue()
+        process = ctx.Process(target=_run, args=(name, root, repeat, warmup, seed, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            res[name] = {'case': name, 'error': 'exit code ' + str(process.exitcode)}
+        else:
+            res[name] = results.get()
+    return res
+
+
+def compare(results, baseline, tolerance=0.25, rss_tolerance=0.25):
+
+    # Cases slower (p50) or bigger (peak RSS) than the baseline by more than the tolerances
+
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None or 'error' in current or 'error' in base:
+            continue
+        if current['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append((name, 'p50_ms', base['p50_ms'], current['p50_ms']))
+        if current['peak_rss_mb'] > base['peak_rss_mb'] * (1 + rss_tolerance):
+            regressions.append((name, 'peak_rss_mb', base['peak_rss_mb'], current['peak_rss_mb']))
+    return regressions
+
+
+def report(results, baseline=None):
+    header = ['case', 'p50_ms', 'p90_ms', 'p99_ms', 'peak_rss_mb']
+    if baseline:
+        header.append('vs_baseline')
+    lines = [' '.join(h.ljust(36 if i == 0 else 12) for i, h in enumerate(header))]
+    for name, r in results.items():
+        if 'error' in r:
+            lines.append(name.ljust(36) + ' ' + r['error'])
+            continue
+        row = [name.ljust(36)] + [str(round(r[key], 2)).ljust(12) for key in header[1:5]]
+        if baseline and name in baseline and 'p50_ms' in baseline[name]:
+            row.append(str(round(r['p50_ms'] / baseline[name]['p50_ms'], 2)) + 'x')
+        lines.append(' '.join(row))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Times the hot paths on a synthetic dataset built by benchmarks.synthetic.')
+    parser.add_argument('root', help='dataset root written by python -m benchmarks.synthetic')
+    parser.add_argument('--cases', nargs='*', choices=list(CASES), default=None)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', default=None, help='writes the results as a baseline json')
+    parser.add_argument('--baseline', default=None, help='baseline json to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative p50 slowdown')
+    parser.add_argument('--rss-tolerance', type=float, default=0.25, help='allowed relative peak RSS growth')
+    args = parser.parse_args()
+
+    results = run(args.root, args.cases, args.repeat, args.warmup, args.seed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print(report(results, baseline))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'root': args.root, 'repeat': args.repeat, 'seed': args.seed, 'results': results}, f, indent=2)
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance, args.rss_tolerance)
+        for name, metric, base, current in regressions:
+            print('Regression in', name + ':', metric, round(base, 2), '->', round(current, 2))
+        if regressions:
+            raise SystemExit(1)
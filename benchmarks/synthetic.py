@@ -0,0 +1,179 @@
+import os
+import argparse
+import contextlib
+import numpy as np
+import pandas as pd
+
+# Seeded generator of a MovieLens shaped dataset
+# Writes data/{movies,links,genres,ratings,contents,desc_movies,desc2_movies,posters,trailers}.csv
+# under a root directory with the columns and literal formats of the real files, movie and
+# term popularity following a power law, and optionally builds every serving artifact there
+# (columnar store, indexes, catalog, leaderboards, token tables, graph, count vectorizer and
+# an SVD model with random factors), so the pages' hot paths can run without the real data
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Fantasy',
+          'Film-Noir', 'Horror', 'IMAX', 'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western',
+          '(no genres listed)']
+
+SCALES = {
+    'small': {'movies': 2_000, 'users': 1_000, 'ratings': 100_000},
+    'medium': {'movies': 10_000, 'users': 20_000, 'ratings': 2_000_000},
+    'large': {'movies': 60_000, 'users': 160_000, 'ratings': 25_000_000},
+}
+
+
+@contextlib.contextmanager
+def inside(root):
+
+    # Runs a block with root as the working directory, the modules use paths relative to the repo root
+
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def _zipf(rng, n, size, a=1.1):
+
+    # Power law ranks in [0, n)
+
+    weights = 1 / np.arange(1, n + 1) ** a
+    return rng.choice(n, size=size, p=weights / weights.sum())
+
+
+def _words(rng, count, vocab, size):
+    return [' '.join('w' + str(i) for i in _zipf(rng, vocab, size)) for _ in range(count)]
+
+
+def _literal(items):
+    return str(list(items))
+
+
+def generate(root, movies=2_000, users=1_000, ratings=100_000, seed=0, chunksize=1_000_000):
+    rng = np.random.default_rng(seed)
+    path = os.path.join(root, 'data')
+    os.makedirs(path, exist_ok=True)
+
+    movie_ids = np.arange(1, movies + 1, dtype=np.int32)
+    tmdb_ids = 1000 + 3 * movie_ids.astype(np.int64)
+    years = rng.integers(1920, 2023, size=movies)
+    titles = ['Movie ' + str(i) + ' (' + str(y) + ')' for i, y in zip(movie_ids, years)]
+
+    onehot = np.zeros((movies, len(GENRES)), dtype=np.uint8)
+    for row, count in enumerate(rng.integers(1, 4, size=movies)):
+        onehot[row, rng.choice(len(GENRES) - 1, size=count, replace=False)] = 1
+    names = ['|'.join(GENRES[j] for j in np.flatnonzero(row)) for row in onehot]
+    pd.DataFrame({'movieId': movie_ids, 'title': titles, 'genres': names}).to_csv(os.path.join(path, 'movies.csv'), index=False)
+    genres = pd.DataFrame(onehot, columns=GENRES)
+    genres.insert(0, 'title', titles)
+    genres.insert(0, 'movieId', movie_ids)
+    genres.to_csv(os.path.join(path, 'genres.csv'), index=False)
+    pd.DataFrame({'movieId': movie_ids, 'imdbId': 100000 + movie_ids, 'tmdbId': tmdb_ids.astype(np.float64)}).to_csv(
+        os.path.join(path, 'links.csv'), index=False)
+
+    # Ratings are written in chunks, popular movies and active users get most of them
+    with open(os.path.join(path, 'ratings.csv'), 'w') as f:
+        f.write('userId,movieId,rating,timestamp\n')
+        for start in range(0, ratings, chunksize):
+            n = min(chunksize, ratings - start)
+            chunk = pd.DataFrame({
+                'userId': _zipf(rng, users, n, 0.8) + 1,
+                'movieId': _zipf(rng, movies, n) + 1,
+                'rating': rng.integers(1, 11, size=n) / 2,
+                'timestamp': rng.integers(800_000_000, 1_600_000_000, size=n),
+            })
+            chunk.to_csv(f, header=False, index=False)
+
+    casts = [['Actor ' + str(i) for i in dict.fromkeys(_zipf(rng, max(movies // 2, 10), rng.integers(1, 12)).tolist())] for _ in range(movies)]
+    keywords = [['keyword' + str(i) for i in dict.fromkeys(_zipf(rng, 2000, rng.integers(0, 10)).tolist())] for _ in range(movies)]
+    overviews = _words(rng, movies, 20_000, 40)
+    pd.DataFrame({
+        'movieId': tmdb_ids, 'title': [t[:-7] for t in titles], 'overview': overviews,
+        'popularity': np.round(rng.pareto(1.5, size=movies) * 10, 3), 'casts': [_literal(c) for c in casts],
+    }).to_csv(os.path.join(path, 'desc_movies.csv'), index=False)
+    pd.DataFrame({
+        'movieId': tmdb_ids, 'vote_count': rng.integers(0, 20_000, size=movies).astype(np.float32),
+        'vote_average': np.round(rng.uniform(1, 10, size=movies), 1), 'keywords': [_literal(k) for k in keywords],
+    }).to_csv(os.path.join(path, 'desc2_movies.csv'), index=False)
+    pd.DataFrame({'movieId': tmdb_ids, 'posters': ['https://image.tmdb.org/t/p/w500/' + str(i) + '.jpg' for i in tmdb_ids]}).to_csv(
+        os.path.join(path, 'posters.csv'), index=False)
+    pd.DataFrame({'movieId': tmdb_ids, 'trailers': [str({'Trailer': 'v' + str(i), 'Teaser': 't' + str(i)}) for i in tmdb_ids]}).to_csv(
+        os.path.join(path, 'trailers.csv'), index=False)
+
+    # contents holds the titles the count vectorizer was fitted on, a sample of the catalog
+    sample = np.sort(rng.choice(movies, size=max(movies // 2, 1), replace=False))
+    pd.DataFrame({
+        'movieId': tmdb_ids[sample], 'title': [titles[i] for i in sample], 'overview': [overviews[i] for i in sample],
+        'casts': [' '.join(c.replace(' ', '').lower() for c in casts[i][:5]) for i in sample],
+    }).to_csv(os.path.join(path, 'contents.csv'), index=False)
+    return {'movies': movies, 'users': users, 'ratings': ratings, 'contents': len(sample)}
+
+
+def build_artifacts(root, factors=50, seed=0):
+
+    # Builds every prebuilt artifact the pages load, as the offline CLIs would
+
+    from scipy import sparse
+    from sklearn.feature_extraction.text import CountVectorizer
+    from utils import datasets
+    from utils import store
+    from utils import graph
+    from utils import tokens
+    from utils import scoring
+    from utils import catalog
+    from utils import featurizer
+    from utils import leaderboard
+    from utils import genre_index
+    from utils import rating_index
+
+    with inside(root):
+        os.makedirs('./systems', exist_ok=True)
+        store.ingest_csv('./data/ratings.csv', 'ratings', store.RATINGS_SCHEMA)
+        rating_index.build()
+        ratings = store.open_table('ratings', columns=['userId', 'movieId', 'rating'])
+        genres = datasets.read('genres')
+        genre_index.GenreIndex.build(genres, ratings['movieId'], ratings['rating']).save()
+        for name in tokens.SOURCES:
+            tokens.build(name, datasets.read).save(name)
+        cat = catalog.Catalog.build(datasets.read('desc_movies'), datasets.read('desc2_movies'), datasets.read('posters'), datasets.read('links'),
+                                    tokens.TokenTable.load('casts'))
+        cat.save()
+        leaderboard.save(leaderboard.build(cat, genres), cat)
+        graph.CoappearanceGraph.from_tokens(tokens.TokenTable.load('casts')).save()
+
+        contents = datasets.read('contents')
+        count = CountVectorizer(stop_words='english')
+        matrix = count.fit_transform(featurizer.documents(contents))
+        sparse.save_npz('./systems/count_matrix.npz', matrix)
+        featurizer.Featurizer.from_vectorizer(count).save('./systems', 'count')
+
+        # Random factors in the shape of a trained SVD, enough to time the scoring paths
+        rng = np.random.default_rng(seed)
+        users = np.unique(np.asarray(ratings['userId'])).astype(np.int64)
+        items = np.unique(np.asarray(ratings['movieId'])).astype(np.int64)
+        scorer = scoring.SVDScorer(rng.normal(0, 0.1, (len(users), factors)), rng.normal(0, 0.1, (len(items), factors)),
+                                   rng.normal(0, 0.1, len(users)), rng.normal(0, 0.1, len(items)), float(np.mean(ratings['rating'])),
+                                   (0.5, 5.0), True, scoring.IdMap(users, np.arange(len(users), dtype=np.int32)),
+                                   scoring.IdMap(items, np.arange(len(items), dtype=np.int32)))
+        scorer.save('./systems', 'svd')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a seeded synthetic MovieLens shaped dataset and its serving artifacts.')
+    parser.add_argument('root')
+    parser.add_argument('--scale', choices=list(SCALES), default='small')
+    parser.add_argument('--movies', type=int, default=None)
+    parser.add_argument('--users', type=int, default=None)
+    parser.add_argument('--ratings', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-artifacts', action='store_true')
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    scale.update({key: getattr(args, key) for key in scale if getattr(args, key) is not None})
+    info = generate(args.root, seed=args.seed, **scale)
+    if not args.no_artifacts:
+        build_artifacts(args.root, seed=args.seed)
+    print('Generated', info['movies'], 'movies,', info['users'], 'users and', info['ratings'], 'ratings in', args.root)
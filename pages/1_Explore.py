@@ -1,36 +1,46 @@
-import ast
-import numpy as np
-import pandas as pd
 import streamlit as st
-from ydata_profiling import ProfileReport
-from streamlit_pandas_profiling import st_profile_report
+import streamlit.components.v1 as components
+from utils import data as datasets
+from utils import metrics
+from utils import profiling
 
 st.set_page_config(page_title="Explore", page_icon=":black_nib:", layout="wide")
 
-@st.cache_data
-def load_data(filename):
-  df = pd.read_csv(filename)
-  return df
+# Only the selected dataset is loaded, the rest stay on disk
+
+DATASETS = {
+  'Movies': datasets.movies,
+  'Desc_movies': datasets.desc_movies,
+  'Desc2_movies': datasets.desc2_movies,
+  'Genres': datasets.genres,
+  'Posters': datasets.posters,
+  'Trailers': datasets.trailers,
+  'Links': datasets.links,
+  'Ratings': datasets.ratings,
+}
+
+# Datasets scraped from TMDb, the others come from MovieLens
+SCRAPED = ('Desc_movies', 'Desc2_movies', 'Posters', 'Trailers')
+
+# Columns the profiling sample is stratified on
+STRATA = {
+  'Ratings': 'rating',
+}
+
+def sources(name):
+
+    # Files a dataset is read from, the ratings come from the columnar store when it was built
+
+    if name == 'Ratings':
+        return ['./data/ratings.csv', datasets.roots()['store'] + '/ratings/meta.json']
+    return [datasets.DATASETS[name.lower()]['file']]
 
 @st.cache_data
-def load_scraped_data(filename):
-  df = pd.read_csv(filename, lineterminator='\n')
-  return df
+def datasetHash(name, signature):
 
-links = load_data('./data/links.csv')
-movies = load_data('./data/movies.csv')
-genres = load_data('./data/genres.csv')
-ratings = load_data('./data/ratings.csv')
-try:
-  posters = load_data('./data/posters.csv')
-  trailers = load_data('./data/trailers.csv')
-  desc_movies = load_data('./data/desc_movies.csv')
-  desc2_movies = load_data('./data/desc2_movies.csv')
-except:
-  posters = load_scraped_data('./data/posters.csv')
-  trailers = load_scraped_data('./data/trailers.csv')
-  desc_movies = load_scraped_data('./data/desc_movies.csv')
-  desc2_movies = load_scraped_data('./data/desc2_movies.csv')
+    # Content hash of a dataset, computed again only when the signature of its files changes
+
+    return profiling.dataset_hash(name, sources(name), DATASETS[name])
 
 st.sidebar.header("Explore")
 st.sidebar.info("Exploration Page lets you explore the various datasets provided by MovieLens and TMDB API.")
@@ -39,38 +49,38 @@ st.header('Exploration')
 
 col1, col2 = st.columns(2)
 with col1:
-    data = st.selectbox("Select The Dataset You'd Like To Explore:",
-                    ('Movies', 'Desc_movies', 'Desc2_movies', 'Genres', 'Posters', 'Trailers', 'Links', 'Ratings'))
+    data = st.selectbox("Select The Dataset You'd Like To Explore:", tuple(DATASETS))
     generate = st.button('Generate Profile')
+    with st.expander('Profiling Settings'):
+      sampleSize = st.number_input('Sample Size (0 for every row)', min_value=0, value=profiling.SETTINGS['sample'], step=10000)
+      minimal = st.checkbox('Minimal Report', value=profiling.SETTINGS['minimal'])
+    df = DATASETS[data]()
 with col2:
     if data:
         st.info(data + ':')
-        st.info('~ ' + ' • '.join(list(eval(data.lower()).columns)) + ' ~')
+        st.info('~ ' + ' • '.join(list(df.columns)) + ' ~')
 if data == 'Ratings':
   st.error('Caution: Large File')
-st.dataframe(eval(data.lower()).head(1000), 100, 250, use_container_width=True)
+st.dataframe(df.head(1000), 100, 250, use_container_width=True)
 if generate:
-  if data != 'Desc_movies' or data != 'Desc2_movies' or data != 'Posters' or data != 'Trailers':
-    profile = ProfileReport(eval(data.lower()),
-                              explorative = True,
-                              dark_mode = True,
-                              lazy = False,
-                              title = data,
-                              dataset = {
-                              "description": "MovieLens 25M movie ratings. Stable benchmark dataset. 25 million ratings and one million tag applications applied to 62,000 movies by 162,000 users. Includes tag genome data with 15 million relevance scores across 1,129 tags.",
-                              "provider": "GroupLens",
-                              "release_year": "2019",
-                              "url": "https://grouplens.org/datasets/movielens/25m/",
-                              })
+  if data not in SCRAPED:
+    dataset = {
+      "description": "MovieLens 25M movie ratings. Stable benchmark dataset. 25 million ratings and one million tag applications applied to 62,000 movies by 162,000 users. Includes tag genome data with 15 million relevance scores across 1,129 tags.",
+      "provider": "GroupLens",
+      "release_year": "2019",
+      "url": "https://grouplens.org/datasets/movielens/25m/",
+    }
   else:
-    profile = ProfileReport(eval(data.lower()),
-                              explorative = True,
-                              dark_mode = True,
-                              lazy = False,
-                              title = data,
-                              dataset = {
-                              "description": "Scraped using the TMDB API.",
-                              "provider": "TMDB",
-                              "url": "https://www.themoviedb.org/documentation/api",
-                              })
-  st_profile_report(profile)
\ No newline at end of file
+    dataset = {
+      "description": "Scraped using the TMDB API.",
+      "provider": "TMDB",
+      "url": "https://www.themoviedb.org/documentation/api",
+    }
+  # Reports are saved per dataset content and settings, only a new dataset or new settings are profiled again
+  settings = profiling.settings(sample=sampleSize, strata=STRATA.get(data), minimal=minimal)
+  with st.spinner('Profiling ' + data + '...'):
+    with metrics.timer('explore.profile'):
+      html = profiling.report(df, data, dataset, settings, datasetHash(data, profiling.signature(sources(data))))
+  components.html(html, height=1200, scrolling=True)
+
+metrics.panel()
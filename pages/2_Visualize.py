@@ -1,43 +1,17 @@
-import re
-import ast
 import numpy as np
 import pandas as pd
-import igraph as ig
-import networkx as nx
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-from pandas.io.parsers.python_parser import count_empty_vals
+from utils import data
+from utils import graph
+from utils import metrics
+from utils import network as network_layout
 
 st.set_page_config(page_title="Visualize", page_icon=":mag:", layout="wide")
 
-@st.cache_data
-def load_data(filename):
-  df = pd.read_csv(filename)
-  return df
-
-@st.cache_data
-def load_scraped_data(filename):
-  df = pd.read_csv(filename, lineterminator='\n')
-  return df
-
-# Might also import the data from '1_Explore.py' using importlib
-
-links = load_data('./data/links.csv')
-movies = load_data('./data/movies.csv')
-genres = load_data('./data/genres.csv')
-ratings = load_data('./data/ratings.csv')
-try:
-  posters = load_data('./data/posters.csv')
-  trailers = load_data('./data/trailers.csv')
-  desc_movies = load_data('./data/desc_movies.csv')
-  desc2_movies = load_data('./data/desc2_movies.csv')
-except:
-  posters = load_scraped_data('./data/posters.csv')
-  trailers = load_scraped_data('./data/trailers.csv')
-  desc_movies = load_scraped_data('./data/desc_movies.csv')
-  desc2_movies = load_scraped_data('./data/desc2_movies.csv')
- 
+# Datasets are loaded lazily through utils/data.py, charts read the pre-joined catalog instead of merging desc_movies with desc2_movies
+
 st.sidebar.header("Visualization")
 st.sidebar.info("Visualization Page lets you visualize various aspects and traits within the datasets.")
 
@@ -49,21 +23,22 @@ with tab1:
     # Static plots are cached to save time
 
     @st.cache_data
+    @metrics.timed('visualize.mostPopularMovies')
     def mostPopularMovies():
 
         # Top 10 most popular movies
 
-        mostPopular = desc_movies.iloc[:, :3].sort_values('popularity', ascending=False)
+        mostPopular = data.catalog().table[['tmdbId', 'title', 'popularity']].sort_values('popularity', ascending=False)
         fig = px.bar(mostPopular[:50], y='title', x='popularity', color='popularity', title='Top 50 Most Popular Movies', color_continuous_scale=px.colors.sequential.thermal)
         return fig
 
     @st.cache_data
+    @metrics.timed('visualize.mostVotedMovies')
     def mostVotedMovies():
 
         # Top 10 most voted movies
 
-        db = pd.merge(desc_movies, desc2_movies, on='movieId', how='inner')
-        mostVoted = db.loc[:, db.columns.intersection(['movieId', 'title', 'vote_count'])].sort_values('vote_count', ascending=False)
+        mostVoted = data.catalog().voted()[['tmdbId', 'title', 'vote_count']].sort_values('vote_count', ascending=False)
         fig = px.bar(mostVoted[:50], y='title', x='vote_count', color='vote_count', title='Top 50 Most Voted Movies', color_continuous_scale=px.colors.sequential.deep)
         return fig
 
@@ -79,10 +54,12 @@ with tab2:
     # Static plots are cached to save time
 
     @st.cache_data
+    @metrics.timed('visualize.genSeg')
     def genSeg():
 
         # Genre seggregation of movies
 
+        genres = data.genres()
         genLabel = list(genres.iloc[:, 2:].columns)
         genCount = []
         for i in range(len(genLabel)):
@@ -92,23 +69,12 @@ with tab2:
         return fig
 
     @st.cache_data
+    @metrics.timed('visualize.keySeg')
     def keySeg():
 
-        # Keyword seggregation of movies
-        
-        db = pd.merge(desc_movies, desc2_movies, on='movieId', how='inner')
-        db = db.loc[:, db.columns.intersection(['movieId', 'title', 'keywords'])]
-        keywords = {}
-        for i in db['keywords'].values:
-            for j in i.strip("']['").split("', '"):
-                if j in keywords:
-                    keywords[j] += 1
-                else:
-                    keywords[j] = 1
-        keywords = dict(sorted(keywords.items(), key=lambda item:item[1], reverse=True))
-        keywords = dict(sorted(keywords.items(), key=lambda item:item[1], reverse=True)[1:101])     # First value is an empty string
-        keys = list(keywords.keys())
-        counts = list(keywords.values())
+        # Keyword seggregation of movies, counted over the keywords token table of the movies that have votes
+
+        keys, counts = data.tokens('keywords').top(100, data.catalog().voted()['tmdbId'])
         fig = px.bar(x=keys, y=counts, color=counts, title='Keyword Seggregation of Movies', color_continuous_scale=px.colors.sequential.Teal)
         return fig
 
@@ -123,20 +89,20 @@ with tab3:
     # Static plots are cached to save time
 
     @st.cache_data
+    @metrics.timed('visualize.avgVoteDist')
     def avgVoteDist():
         
         # Average vote distribution
 
-        db = pd.merge(desc_movies, desc2_movies, on='movieId', how='inner')
-        db = db.loc[:, db.columns.intersection(['movieId', 'title', 'vote_average'])]
+        db = data.catalog().voted()[['tmdbId', 'title', 'vote_average']]
         voteDist = db.groupby('vote_average')['vote_average'].count().reset_index(name='vote_dist').sort_values('vote_dist', ascending=False)
         fig = px.scatter(voteDist, x='vote_average', y='vote_dist', size='vote_dist', color='vote_dist', title='Average Vote Distribution', color_continuous_scale=px.colors.sequential.Burg, marginal_x='histogram', marginal_y='rug')
         return fig
     
     @st.cache_data
+    @metrics.timed('visualize.popCountDist')
     def popCountDist():
-        db = pd.merge(desc_movies, desc2_movies, on='movieId', how='inner')
-        popCountDist = db.loc[:1000, db.columns.intersection(['movieId', 'title', 'popularity', 'vote_count'])]
+        popCountDist = data.catalog().voted()[['tmdbId', 'title', 'popularity', 'vote_count']].iloc[:1001]
         fig = px.scatter(popCountDist, x='popularity', y='vote_count', size='vote_count', color='vote_count', title='Cross Appearance of Popularity and Vote Count', color_continuous_scale=px.colors.sequential.Darkmint, marginal_x='rug', marginal_y='rug')
         return fig
 
@@ -149,60 +115,18 @@ with tab3:
 with tab4:
 
     # Coappearance of actors
-    def casts(x):
-        return ', '.join(ast.literal_eval(x.casts))
-
-    def network(graphWeights, actors):
-
-        graphWeights = graphWeights[graphWeights['source'] != graphWeights['target']]
-        group, count = 1, 1
-
-        nodes = []
-        for key, val in actors.items():
-            node = {}
-            node['name'] = key
-            node['group'] = group
-            if count == 2:
-                count = 1
-                group += 1
-            nodes.append(node)
-            count += 1
-
-        links = []
-        for i in graphWeights.values:
-            link = {}
-            link['source'] = actors[i[0]]
-            link['target'] = actors[i[1]]
-            link['value'] = i[2]
-            links.append(link)
-        N=len(nodes)
-        L=len(links)
-
-        Edges=[(links[k]['source'], links[k]['target']) for k in range(L)]
-        G=ig.Graph(Edges, directed=False)
-        labels=[]
-        group=[]
-        for node in nodes:
-            labels.append(node['name'])
-            group.append(node['group'])
-        layt=G.layout('kk', dim=3)
-
-        Xn=[layt[k][0] for k in range(N)]# x-coordinates of nodes
-        Yn=[layt[k][1] for k in range(N)]# y-coordinates
-        Zn=[layt[k][2] for k in range(N)]# z-coordinates
-        Xe=[]
-        Ye=[]
-        Ze=[]
-        for e in Edges:
-            Xe+=[layt[e[0]][0],layt[e[1]][0], None]# x-coordinates of edge ends
-            Ye+=[layt[e[0]][1],layt[e[1]][1], None]
-            Ze+=[layt[e[0]][2],layt[e[1]][2], None]
-        Gnx = nx.Graph(Edges) 
-        node_adjacencies = []
-        node_text = []
-        for node, adjacencies in enumerate(Gnx.adjacency()):
-            node_adjacencies.append(len(adjacencies[1]))
-            node_text.append('# of connections: '+str(len(adjacencies[1])))
+    # Ego networks above network.MAX_NODES actors keep their top weight co-stars, above network.KK_LIMIT
+    # they use the cheaper 'fr' layout (see utils/network.py)
+
+    @metrics.timed('visualize.network')
+    def network(ego, names):
+
+        # Traces of an ego network layout, degrees and edge segments come as NumPy arrays
+
+        Xn, Yn, Zn = ego.coords[:, 0], ego.coords[:, 1], ego.coords[:, 2]
+        Xe, Ye, Ze = ego.segments()
+        node_adjacencies = ego.degrees()
+        labels = [names[i] for i in ego.nodes]
         trace1=go.Scatter3d(x=Xe,
                     y=Ye,
                     z=Ze,
@@ -260,58 +184,38 @@ with tab4:
                         )
                         )
                     ])
-        data=[trace1, trace2]
-        return data, layout
-
-    tempdb = pd.concat([desc_movies.iloc[:, :-3], desc_movies.apply(casts, axis=1)], axis=1)
-    tempdb = tempdb.rename(columns={0: 'casts'})
-    tempdb = tempdb[tempdb['casts'] != '']
-    tempdb = tempdb[tempdb['casts'].str.contains(u', ')]
-
-    actors = {}
-    casts = list(tempdb.casts)
-    for i in casts:
-        j = i.split(', ')
-        if j[0] not in actors:
-            actors[j[0]] = j[1:]
-        if j[0] in actors:
-            actors[j[0]] += j[1:]
-
-    graphActors = {key: val for key, val in actors.items() if val != []}
-    count = 0
-    actors = {}
-    for i in casts:
-        for j in i.split(', '):
-            if j not in actors:
-                actors[j] = count
-                count += 1
-    source = []
-    target = []
-    weight = []
-    for key, value in graphActors.items():
-        worked = {}
-        source += [key] * len(set(value))
-        for i in value:
-            if i not in worked:
-                worked[i] = 1
-            else:
-                worked[i] += 1
-        target += worked.keys()
-        weight += worked.values()
-    graphWeights = pd.DataFrame({'source': source, 'target': target, 'weight': weight})
-
-    choices = list(actors.keys())
-    choice = st.selectbox('Choose An Actor:', sorted(choices))
-    tempdb = graphWeights[(graphWeights['source'] == choice) | (graphWeights['target'] == choice)]
-    tempact = {}
-    count = 0
-    for i in tempdb.values:
-        if i[0] not in tempact:
-            tempact[i[0]] = count
-            count += 1
-        if i[1] not in tempact:
-            tempact[i[1]] = count
-            count += 1
-    data, layout = network(tempdb, tempact)
-    fig=go.Figure(data=data, layout=layout)
-    st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+        traces=[trace1, trace2]
+        return traces, layout
+
+    @st.cache_resource
+    @metrics.timed('visualize.load_graph')
+    def load_graph():
+
+        # Built by 'python -m utils.graph', otherwise once per process from the casts token table
+
+        try:
+            return graph.CoappearanceGraph.load(data.roots()['store'])
+        except FileNotFoundError:
+            return graph.CoappearanceGraph.from_tokens(data.tokens('casts'))
+
+    @st.cache_resource
+    def load_layouts():
+        return network_layout.LayoutCache(load_graph(), max_nodes=network_layout.MAX_NODES, kk_limit=network_layout.KK_LIMIT)
+
+    @st.cache_resource
+    def actorChoices():
+        return sorted(load_graph().names)
+
+    coappearance = load_graph()
+    choice = st.selectbox('Choose An Actor:', actorChoices())
+
+    # Layouts are computed once per actor and kept in an LRU cache, large ego networks are pruned
+    with metrics.timer('visualize.layout'):
+        ego = load_layouts().get(choice)
+    if ego.pruned:
+        st.caption('Showing the ' + str(len(ego.nodes) - 1) + ' most frequent co-stars of ' + str(coappearance.degree(coappearance.id(choice))) + '.')
+    traces, layout = network(ego, coappearance.names)
+    fig=go.Figure(data=traces, layout=layout)
+    st.plotly_chart(fig, use_container_width=True)
+
+metrics.panel()
@@ -1,46 +1,29 @@
-import re
-import ast
-import joblib
 import random
-import numpy as np
-import pandas as pd
-import configparser
 import streamlit as st
-from scipy import sparse
-from surprise import dump
-from tmdbv3api import TMDb
-from tmdbv3api import Movie
-from collections import defaultdict
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+from utils import data
+from utils import metrics
+from utils import service
+from utils import leaderboard
 
 st.set_page_config(page_title="Recommend", page_icon=":movie_camera:", layout="wide")
 
-@st.cache_data
-def load_data(filename):
-  df = pd.read_csv(filename)
-  return df
-
-@st.cache_data
-def load_scraped_data(filename):
-  df = pd.read_csv(filename, lineterminator='\n')
-  return df
-
-links = load_data('./data/links.csv')
-movies = load_data('./data/movies.csv')
-genres = load_data('./data/genres.csv')
-ratings = load_data('./data/ratings.csv')
-try:
-  posters = load_data('./data/posters.csv')
-  trailers = load_data('./data/trailers.csv')
-  desc_movies = load_data('./data/desc_movies.csv')
-  desc2_movies = load_data('./data/desc2_movies.csv')
-except:
-  posters = load_scraped_data('./data/posters.csv')
-  trailers = load_scraped_data('./data/trailers.csv')
-  desc_movies = load_scraped_data('./data/desc_movies.csv')
-  desc2_movies = load_scraped_data('./data/desc2_movies.csv')
- 
+# The recommenders live in utils/recommend.py and return TMDb ids with scores, the page renders
+# them from the pre-joined catalog (see utils/catalog.py). With a url in the [Service] section of
+# env.config the page calls the recommendation service (see utils/service.py) instead, and the
+# recommenders with their scipy and model dependencies are never imported. Nothing is loaded
+# at import: the catalog on the first render, the local recommender on the first request
+
+SERVICE_URL = service.read_config('env.config')['url']
+
+@st.cache_resource
+def load_recommender():
+    if SERVICE_URL:
+        return service.Client(SERVICE_URL)
+    from utils import recommend
+    roots = data.roots()
+    return recommend.Recommender.load(data.catalog(), data.leaderboards(), data.contents(), data.links(['movieId', 'tmdbId']), data.genres(),
+                                      data.ratings, models=roots['models'], root=roots['store'])
+
 st.sidebar.header("Recommendation")
 st.sidebar.info("Recommendation Page lets you ask for recommendations on given inputs, along with a few other popular movies.")
 
@@ -54,7 +37,7 @@ def mov(res, ind):
     st.image(res[ind]['Poster'])
     st.subheader(res[ind]['Title'])
     st.caption(res[ind]['Overview'])
-    st.write(' • '.join(ast.literal_eval(res[ind]['Cast'])))
+    st.write(' • '.join(res[ind]['Cast']))
 
 def container(desc):
 
@@ -74,203 +57,74 @@ def container(desc):
     except:
         pass
 
+def localPopular(name, num):
+
+    # Samples the local leaderboards, also the fallback when the recommendation service is down
+
+    return data.catalog().render(leaderboard.sample(data.leaderboards(), name, num))
+
 with tab1:
 
-    def popularMeasureTMDB(db, num):
+    def popularMeasureTMDB(name, num):
 
-        # Selects top 500 most popular movies and returns a random sample of 5 from them
+        # Returns a random sample of 5 from the prebuilt top 500 most popular movies, locally
+        # sampled from the leaderboards without loading the recommender
 
-        suggestions = []
-        popularity = db.sort_values('popularity', ascending=False)
-        res = pd.merge(popularity[:500], posters, on='movieId', how='inner')
-        res = res.sample(n = num)[['movieId', 'title', 'overview', 'posters', 'casts']]
-        for i in res.values:
-            result = {}
-            result['Title'] = i[1]
-            result['Overview'] = i[2]
-            result['Poster'] = i[3]
-            result['Cast'] = i[4]
-            suggestions.append(result)
-        return suggestions
+        with metrics.timer('page.popularMeasureTMDB'):
+            if not SERVICE_URL:
+                return localPopular(name, num)
+            try:
+                ids = load_recommender().popular(name, num)['ids']
+            except service.ServiceError:
+                return localPopular(name, num)
+            catalog = data.catalog()
+            return catalog.render(catalog.rows_by_tmdb(ids))
 
-    desc = popularMeasureTMDB(desc_movies, 5)
+    desc = popularMeasureTMDB(leaderboard.ALL, 5)
     container(desc)
 
     # Genre wise popular selection
 
     st.subheader('Select A Genre:')
-    gen = st.select_slider('Genre', options=list(genres.iloc[:, 2:-1]), label_visibility='collapsed')
+    gen = st.select_slider('Genre', options=data.columns('genres')[2:-1], label_visibility='collapsed')
     st.subheader(gen)
-    tempdb = pd.merge(genres[genres[gen] == 1], links, on='movieId', how='inner')
-    tempdb = tempdb[['tmdbId']].rename(columns={'tmdbId': 'movieId'})
-    tempdb = pd.merge(tempdb, desc_movies[['movieId', 'title', 'overview', 'popularity', 'casts']], on='movieId', how='inner')
 
-    desc = popularMeasureTMDB(tempdb, 5)
+    desc = popularMeasureTMDB(gen, 5)
     container(desc)
 
 with tab2:
 
-    # Contents is the sampled dataframe on which the vectorizer was fitted
-    try:
-        tempdb = load_data('./data/contents.csv')
-
-    except:
-        tempdb = load_scraped_data('./data/contents.csv')
-
-    @st.cache_data
-    def load_count():
-        return joblib.load('./systems/count.pkl')
-    count = load_count()
-
-    # The following dataset is required for collaborative recommendations
-    temp = tempdb
-    temp['title'] = temp['title'].apply(lambda x: x[:-7])
-
-    def overTitle(title):
-
-        # Retrieves only the title and overview of a movie
-
-        tmdb = TMDb()
-        movie = Movie()
-        tmdb.api_key = API_KEY
-        tmdb.language = 'en'
-        tmdb.debug = True
-
-        mov = movie.search(title)[0]
-        title = mov.title.lower()
-        overview = mov.overview.lower()
-        result = re.sub("[^a-zA-Z0-9 ]", "", title + ' ' + overview)
-        return mov.title, result
-
-    def descTitle(title):
-
-        # Retrieves title, overview, genres, casts and keywords of a movie
-
-        tmdb = TMDb()
-        movie = Movie()
-        tmdb.api_key = API_KEY
-        tmdb.language = 'en'
-        tmdb.debug = True
-        mov = movie.details(movie.search(title)[0].id)
-        title = mov.title.lower()
-        overview = mov.overview.lower()
-        genres = ' '.join(i.name.lower() for i in mov.genres)
-        casts = ' '.join(i.name.replace(' ', '').lower() for i in mov.casts.cast[:5])
-        keywords = ' '.join(i.name.replace(' ', '').lower() for i in mov.keywords.keywords)
-        result = re.sub("[^a-zA-Z0-9 ]", "", title + ' ' + overview + ' ' +  casts + ' ' +  genres + ' ' +  keywords)
-        return mov.title, result, genres
-
-    def load_count_matrix():
-        return sparse.load_npz('./systems/count_matrix.npz')
-
     def contextBasedRecommendations(title, num):
 
-        # Fetches top 10 results based on similarity (not more as it may lose relevance) but returns 5 random ones
+        # Fetches the num most similar titles (not more as it may lose relevance), from the precomputed
+        # neighbors for catalog titles and through TMDb otherwise
 
-        try:
+        with metrics.timer('page.contextBasedRecommendations'):
             try:
-                title, desc, gList = descTitle(title)
-            except:
-                title, desc = overTitle(title)
-                gList = None
-        except:
+                res = load_recommender().content(title, num)
+            except service.ServiceError as e:
+                res = {'title': 'Avatar (2009)', 'genres': None, 'ids': None, 'error': str(e)}
+        if res.get('error') is not None:
             # In case the API fails to retrieve results, displaying some popular movies
             # While returning the title of the most popular movie for collaborative recommendation
             st.error('API Response Down! Here\'s a few popular movies~')
-            return 'Avatar (2009)', popularMeasureTMDB(desc_movies, num), None
-
-        query_vec = count.transform([desc]) 
-        count_matrix = load_count_matrix()                                            # Transforming the modified title into a query vec using the fitted count vectorizer
-        similarity = cosine_similarity(query_vec, count_matrix).flatten()             # Computing cosine similarity measure
-        inx = np.argsort(similarity)[::-1][0:num]                                     # Getting the most relevant recommendations
-        res = tempdb.iloc[inx][['movieId', 'title', 'overview', 'casts']]
-        res = pd.merge(res, posters, on='movieId', how='inner')[['movieId', 'title', 'overview', 'posters', 'casts']]
-
-        suggestions = []
-        for i in res.values:
-            result = {}
-            result['Title'] = i[1]
-            result['Overview'] = i[2]
-            result['Poster'] = i[3]
-            result['Cast'] = i[4]
-            suggestions.append(result)
-        return title, suggestions, gList
+        if res['ids'] is None:
+            return res['title'], localPopular(leaderboard.ALL, num), res['genres']
+        catalog = data.catalog()
+        return res['title'], catalog.render(catalog.rows_by_tmdb(res['ids'])), res['genres']
 
     def collaborativeBasedRecommendations(title, gList, num):
 
-       # Randomly selects users who have rated the provided title and then finds their highest rated movies before randomly showing it
-
-       # Breaks down the genre list to find the movies containing those genres
-        if gList != None:
-            gList = [item.capitalize() for item in gList.split(' ')]
-            cond = ''
-            x = tempdb
-            for i in range(len(gList)):
-                cond += ' (genres[gList[' + str(i) + ']] == 1) |'
-                try:
-                    x = pd.merge(genres[eval(cond[:-2])], tempdb, on='movieId', how='inner')
-                    x = pd.merge(x, ratings, on='movieId', how='inner').sort_values('rating', ascending=False)
-                except:
-                    x = tempdb
-        else:
-            x = tempdb
-
-        try:
-            id = float(list(t[t['title'] == ''].sort_values('movieId')['movieId'])[0])
-            id = int(links[links["tmdbId"] == id]['movieId'])
-            userList = list(ratings[ratings['movieId'] == id].sort_values('rating', ascending=False)['userId'])[:100]
-        except:
-            mostUsers = ratings.iloc[:, :1].groupby('userId')['userId'].count().reset_index(name='count')
-            mostUsers = mostUsers.sort_values('count')
-            userList = list(mostUsers['userId'])[:100]
-        
-        movieIdx = list(np.unique(x.movieId))[:1000]
-
-        @st.cache_data
-        def load_svd():
-            return dump.load('./systems/svd.pkl')
-
-        _, svd = load_svd()
-
-        predictions = []
-        suggestions = []
-        uList = random.sample(userList, 10) if len(userList)>10 else userList
-        mList = np.unique(random.sample(movieIdx, 100))
-
-        for userId in uList:
-            for i in mList:
-                predictions.append(svd.predict(userId, i))
-
-            # First map the predictions for the given user
-            top_n = defaultdict(list)
-            for uid, iid, true_r, est, _ in predictions:
-                top_n[uid].append((iid, est))
-
-            # Then sort the predictions for the given user and retrieve the k highest ones.
-            for uid, user_ratings in top_n.items():
-                user_ratings.sort(key=lambda x: x[1], reverse=True)
-                top_n[uid] = user_ratings[:num]
-
-            uid = list(top_n.items())[0][0]
-            user_ratings = list(top_n.items())[0][1]
-            movieIds = [iid for (iid, _) in user_ratings]
-            ids = pd.DataFrame({'movieId': movieIds})
-            res = pd.merge(movies, ids, on='movieId', how='inner')
-            res = pd.merge(links, res, on='movieId', how='inner')[['tmdbId', 'genres']].rename(columns={'tmdbId': 'movieId'})
-            res = pd.merge(desc_movies, res, on='movieId', how='inner')
-            res = pd.merge(res, posters, on='movieId', how='inner')[['movieId', 'title', 'overview', 'posters', 'casts']]
-
-            for i in res.values:
-                result = {}
-                result['Title'] = i[1]
-                result['Overview'] = i[2]
-                result['Poster'] = i[3]
-                result['Cast'] = i[4]
-                suggestions.append(result)
-        rec = []
-        for i in suggestions:
-            if i not in rec:
-                rec.append(i)
+        # Randomly selects users who have rated the provided title and then finds their highest rated movies before randomly showing it
+
+        with metrics.timer('page.collaborativeBasedRecommendations'):
+            try:
+                res = load_recommender().collaborative(title, gList, num)
+            except service.ServiceError:
+                return localPopular(leaderboard.ALL, num)
+        with metrics.timer('page.render'):
+            catalog = data.catalog()
+            rec = catalog.render(catalog.rows_by_tmdb(res['ids']))
         return (random.sample(rec, num) if len(rec)>num else rec)
 
 
@@ -279,10 +133,6 @@ with tab2:
     name = form.text_input('Enter Your Movie Title:', 'The Dark Knight')
     generate = form.form_submit_button('Generate Recommendations:')
 
-    config = configparser.ConfigParser()
-    config.read('env.config')
-    API_KEY = config['APIKey']['API_KEY']
-
     if generate:
         title, desc, gList = contextBasedRecommendations(name, 5)
         container(desc)
@@ -290,4 +140,6 @@ with tab2:
         st.subheader('Users Also Liked')
     
         descCol = collaborativeBasedRecommendations(title, gList, 5)
-        container(descCol)
\ No newline at end of file
+        container(descCol)
+
+metrics.panel()
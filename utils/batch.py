@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import glob
+import shutil
+import hashlib
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from utils import store
+from utils import neighbors
+from utils import recommend
+from utils import similarity
+
+# Offline batch recommendations for the whole catalog and user base
+#   content: the top N content neighbors of every title of contents.csv (itself left out),
+#            scored against the count matrix by utils/neighbors.py
+#   svd:     the top N SVD recommendations of every user in the ratings, movies the user
+#            already rated left out
+# The rows are split into shards of chunksize rows scored by a process pool. Every worker
+# writes its shard to its own part file, so memory stays bounded by the shards in flight.
+# A manifest records the job parameters, inputs and a hash of the row ids (the titles of
+# contents.csv or the users in the ratings), and an interrupted job resumes by
+# skipping the shards whose part file already exists
+
+BATCH_DIR = './systems/batch'
+BATCH_VERSION = 1
+
+_job = {}
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+def part_path(output, shard):
+    return os.path.join(output, 'part-' + str(shard).zfill(5) + '.npz')
+
+
+def _write_part(output, shard, arrays):
+    path = part_path(output, shard)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def _init_content(matrix, ids):
+    neighbors.init(matrix)
+    _job.update(ids=ids)
+
+
+def _content_shard(task):
+    output, shard, start, stop, n = task
+    began = time.time()
+    inx, scores = neighbors.top(start, stop, n, exclude_self=True)
+    _write_part(output, shard, {'rows': np.arange(start, stop, dtype=np.int32), 'ids': _job['ids'][inx], 'scores': scores})
+    return shard, stop - start, time.time() - began
+
+
+def _init_svd(models, root, users):
+    _job.update(scorer=recommend.load_scorer(models), indexes=recommend.load_rating_indexes(root), users=users)
+    _job['items'] = np.sort(np.asarray(_job['scorer'].items.raw))
+
+
+def _svd_shard(task):
+    output, shard, start, stop, n = task
+    began = time.time()
+    users, items = _job['users'][start:stop], _job['items']
+    est = _job['scorer'].score(users, items)
+    if _job['indexes'] is not None:
+        by_user = _job['indexes'][1]
+        for row, user in enumerate(users.tolist()):
+            rated = np.asarray(by_user.get(user)[0])
+            pos = np.searchsorted(items, rated)
+            pos = pos[(pos < len(items)) & (items[np.minimum(pos, len(items) - 1)] == rated)]
+            est[row, pos] = -np.inf
+    inx, scores = similarity.topk(est, n)
+    _write_part(output, shard, {'users': users.astype(np.int32), 'ids': items[inx].astype(np.int32), 'scores': scores.astype(np.float16)})
+    return shard, stop - start, time.time() - began
+
+
+def _manifest(output, info, restart):
+
+    # Starts a new job directory, or checks that an existing one ran with the same parameters and inputs
+
+    path = os.path.join(output, 'manifest.json')
+    if restart:
+        shutil.rmtree(output, ignore_errors=True)
+    if os.path.exists(path):
+        with open(path) as f:
+            saved = json.load(f)
+        if {k: v for k, v in saved.items() if k != 'complete'} != info:
+            raise ValueError(output + ' holds a job with other parameters or inputs, rerun with --restart')
+        return
+    os.makedirs(output, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(info, f, indent=2)
+
+
+def _finish(output):
+    path = os.path.join(output, 'manifest.json')
+    with open(path) as f:
+        info = json.load(f)
+    info['complete'] = True
+    with open(path, 'w') as f:
+        json.dump(info, f, indent=2)
+
+
+def run(job, output, ids, n, chunksize, processes, initializer, initargs, inputs, restart=False, log=print):
+
+    # Scores the missing shards of a job over a process pool, reporting throughput as shards finish.
+    # ids are the rows of the job in order, a resumed job must have the same ones
+
+    rows = len(ids)
+    info = {'version': BATCH_VERSION, 'job': job, 'rows': rows, 'n': n, 'chunksize': chunksize,
+            'ids': hashlib.sha1(np.ascontiguousarray(ids, dtype=np.int64).tobytes()).hexdigest(),
+            'inputs': {path: _stat(path) for path in inputs}}
+    _manifest(output, info, restart)
+    shards = [(shard, start, min(start + chunksize, rows)) for shard, start in enumerate(range(0, rows, chunksize))]
+    tasks = [(output, shard, start, stop, n) for shard, start, stop in shards if not os.path.exists(part_path(output, shard))]
+    skipped = len(shards) - len(tasks)
+    if skipped:
+        log('Resuming ' + job + ': ' + str(skipped) + ' of ' + str(len(shards)) + ' shards already done')
+
+    worker = _content_shard if job == 'content' else _svd_shard
+    began, done, total = time.time(), 0, sum(stop - start for _, _, start, stop, _ in tasks)
+    with Pool(processes or os.cpu_count(), initializer=initializer, initargs=initargs) as pool:
+        for shard, count, seconds in pool.imap_unordered(worker, tasks):
+            done += count
+            elapsed = time.time() - began
+            rate = done / elapsed if elapsed > 0 else 0.0
+            eta = (total - done) / rate if rate > 0 else 0.0
+            log(job + ' shard ' + str(shard) + ': ' + str(done) + '/' + str(total) + ' rows, '
+                + str(round(rate, 1)) + ' rows/s, shard ' + str(round(seconds, 2)) + ' s, eta ' + str(round(eta)) + ' s')
+    _finish(output)
+    return done, time.time() - began
+
+
+def parts(output):
+
+    # Iterates over the part files of a job in shard order, one dict of arrays at a time
+
+    for path in sorted(glob.glob(os.path.join(output, 'part-*.npz'))):
+        with np.load(path) as f:
+            yield {key: f[key] for key in f.files}
+
+
+def load(output):
+
+    # Concatenates all part files of a finished job
+
+    with open(os.path.join(output, 'manifest.json')) as f:
+        if not json.load(f).get('complete'):
+            raise ValueError(output + ' has not finished')
+    res = {}
+    for part in parts(output):
+        for key, values in part.items():
+            res.setdefault(key, []).append(values)
+    return {key: np.concatenate(values) for key, values in res.items()}
+
+
+def content_job(output, n=50, chunksize=512, processes=None, restart=False, matrix='./systems/count_matrix.npz', contents=None):
+    from utils import datasets
+
+    contents = contents if contents is not None else datasets.read('contents', ['movieId'])
+    ids = contents['movieId'].to_numpy(dtype=np.int64)
+    return run('content', output, ids, n, chunksize, processes, _init_content, (matrix, ids), [matrix], restart)
+
+
+def svd_job(output, n=50, chunksize=128, processes=None, restart=False, models=recommend.MODEL_ROOT, root=store.STORE_DIR):
+    indexes = recommend.load_rating_indexes(root)
+    if indexes is not None:
+        users = np.flatnonzero(np.diff(np.asarray(indexes[1].indptr))).astype(np.int64)
+    else:
+        users = np.unique(store.load_ratings('./data/ratings.csv', root)['userId'].to_numpy()).astype(np.int64)
+    model = os.path.join(store.table_path('svd', models), 'meta.json')
+    inputs = [model if os.path.exists(model) else os.path.join(models, 'svd.pkl')]
+    return run('svd', output, users, n, chunksize, processes, _init_svd, (models, root, users), inputs, restart)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precomputes content neighbors of every title and SVD recommendations of every user.')
+    parser.add_argument('job', choices=['content', 'svd'])
+    parser.add_argument('--output', default=None, help='defaults to ' + BATCH_DIR + '/<job>')
+    parser.add_argument('-n', type=int, default=50)
+    parser.add_argument('--chunksize', type=int, default=None, help='rows per shard, 512 titles or 128 users by default')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--restart', action='store_true', help='discards the parts of a previous run')
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(BATCH_DIR, args.job)
+    if args.job == 'content':
+        done, seconds = content_job(output, args.n, args.chunksize or 512, args.processes, args.restart)
+    else:
+        done, seconds = svd_job(output, args.n, args.chunksize or 128, args.processes, args.restart)
+    print('Scored', done, 'rows in', round(seconds, 1), 's to', output)
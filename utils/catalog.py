@@ -0,0 +1,183 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from utils import store
+from utils import tokens
+
+# Pre-joined movie catalog
+# desc_movies, desc2_movies, posters and links are joined once into one table keyed by
+# tmdbId, with dense id -> row arrays for TMDb and MovieLens ids, so turning k recommended
+# ids into display rows is an O(k) gather instead of a multi-way merge over full tables.
+# Casts are kept as the token table of utils/tokens.py, keywords are served by utils/tokens.py.
+# Besides the pickle, the catalog can be written to the columnar store and mapped read-only
+# with its text columns as Arrow strings over the mapped bytes (see utils/shared.py)
+
+CATALOG_FILE = './data/store/catalog.pkl'
+CATALOG_NAME = 'catalog'
+CATALOG_VERSION = 2
+TEXT_COLUMNS = ('title', 'overview', 'posters')
+
+
+def _dense_index(ids, rows):
+    ids = np.asarray(ids, dtype=np.int64)
+    index = np.full(int(ids.max()) + 1 if len(ids) else 0, -1, dtype=np.int32)
+    index[ids] = rows
+    return index
+
+
+def _encode_text(values):
+
+    # UTF-8 bytes with int64 offsets and a validity bitmap, the buffers of an Arrow large_string array
+
+    valid = pd.notna(values).to_numpy()
+    encoded = [v.encode('utf-8') if ok else b'' for v, ok in zip(values.tolist(), valid)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8), np.packbits(valid, bitorder='little')
+
+
+def _text_column(offsets, data, valid, rows):
+
+    # Wraps the mapped buffers in an Arrow string array, the strings are never copied into Python objects
+
+    import pyarrow as pa
+    array = pa.LargeStringArray.from_buffers(rows, pa.py_buffer(offsets), pa.py_buffer(data), pa.py_buffer(valid))
+    return pd.arrays.ArrowExtensionArray(array)
+
+
+class Catalog:
+
+    def __init__(self, table, by_tmdb, by_movie, casts):
+        self.table = table
+        self.by_tmdb = by_tmdb
+        self.by_movie = by_movie
+        self.casts = casts
+
+    @classmethod
+    def build(cls, desc_movies, desc2_movies, posters, links, casts=None):
+        if casts is None:
+            casts = tokens.TokenTable.build(desc_movies['movieId'].tolist(), desc_movies['casts'].tolist())
+        table = desc_movies[['movieId', 'title', 'overview', 'popularity']].rename(columns={'movieId': 'tmdbId'})
+        table = table.dropna(subset=['tmdbId']).drop_duplicates('tmdbId')
+        table['tmdbId'] = table['tmdbId'].astype(np.int64)
+
+        posters = posters[['movieId', 'posters']].dropna().drop_duplicates('movieId').rename(columns={'movieId': 'tmdbId'})
+        table = pd.merge(table, posters.astype({'tmdbId': np.int64}), on='tmdbId', how='left')
+
+        votes = desc2_movies[['movieId', 'vote_count', 'vote_average']].drop_duplicates('movieId')
+        votes = votes.rename(columns={'movieId': 'tmdbId'}).dropna(subset=['tmdbId']).astype({'tmdbId': np.int64})
+        table = pd.merge(table, votes.assign(voted=True), on='tmdbId', how='left')
+        table['voted'] = table['voted'].fillna(False).astype(bool)
+
+        links = links[['movieId', 'tmdbId']].dropna()
+        links = links[links['tmdbId'].isin(table['tmdbId'])].astype(np.int64)
+        table = pd.merge(table, links.drop_duplicates('tmdbId'), on='tmdbId', how='left')
+        table['movieId'] = table['movieId'].fillna(-1).astype(np.int32)
+        table = table.reset_index(drop=True)
+
+        by_tmdb = _dense_index(table['tmdbId'], np.arange(len(table), dtype=np.int32))
+        by_movie = _dense_index(links['movieId'], by_tmdb[links['tmdbId'].to_numpy()])
+        return cls(table, by_tmdb, by_movie, casts)
+
+    @classmethod
+    def load(cls, filename=CATALOG_FILE):
+        saved = pd.read_pickle(filename)
+        if saved.get('version') != CATALOG_VERSION:
+            raise ValueError('Unsupported catalog version in ' + filename)
+        casts = saved['casts']
+        return cls(saved['table'], saved['by_tmdb'], saved['by_movie'], tokens.TokenTable(**casts))
+
+    @classmethod
+    def attach(cls, root=store.STORE_DIR, name=CATALOG_NAME):
+
+        # Maps the catalog written by save_table, numeric columns and indexes are plain mapped arrays
+
+        meta = store.read_meta(name, root)
+        if meta.get('catalog_version') != CATALOG_VERSION:
+            raise ValueError('Unsupported catalog version in ' + store.table_path(name, root))
+        arrays = store.open_table(name, root)
+        rows = meta['rows']
+        table = pd.DataFrame({col: _text_column(arrays[col + '.offsets'], arrays[col + '.data'], arrays[col + '.valid'], rows)
+                              if col in meta['text'] else arrays[col] for col in meta['table']}, copy=False)
+        casts = tokens.TokenTable(arrays['casts.movie_ids'], arrays['casts.positions'], arrays['casts.tokens'],
+                                  store.decode_strings(arrays['casts.vocab']))
+        return cls(table, arrays['by_tmdb'], arrays['by_movie'], casts)
+
+    def save_table(self, root=store.STORE_DIR, name=CATALOG_NAME):
+        arrays = {}
+        for col in self.table.columns:
+            if col in TEXT_COLUMNS:
+                arrays[col + '.offsets'], arrays[col + '.data'], arrays[col + '.valid'] = _encode_text(self.table[col])
+            else:
+                arrays[col] = self.table[col].to_numpy()
+        arrays.update({'by_tmdb': self.by_tmdb, 'by_movie': self.by_movie, 'casts.movie_ids': self.casts.movie_ids,
+                       'casts.positions': self.casts.positions, 'casts.tokens': self.casts.tokens,
+                       'casts.vocab': store.encode_strings(self.casts.vocab)})
+        meta = {'catalog_version': CATALOG_VERSION, 'rows': len(self.table), 'table': list(self.table.columns),
+                'text': [col for col in self.table.columns if col in TEXT_COLUMNS]}
+        return store.write_arrays(name, arrays, meta, root)
+
+    def save(self, filename=CATALOG_FILE):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp = filename + '.tmp'
+        casts = {'movie_ids': np.asarray(self.casts.movie_ids), 'positions': np.asarray(self.casts.positions),
+                 'tokens': np.asarray(self.casts.tokens), 'vocab': self.casts.vocab}
+        pd.to_pickle({'version': CATALOG_VERSION, 'table': self.table, 'by_tmdb': self.by_tmdb, 'by_movie': self.by_movie, 'casts': casts}, tmp)
+        os.replace(tmp, filename)
+
+    def __len__(self):
+        return len(self.table)
+
+    @staticmethod
+    def _lookup(index, ids):
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        inside = (ids >= 0) & (ids < len(index))
+        rows = np.full(len(ids), -1, dtype=np.int32)
+        rows[inside] = index[ids[inside]]
+        return rows
+
+    def rows_by_tmdb(self, ids):
+
+        # Catalog rows of TMDb ids, -1 for ids missing from the catalog
+
+        return self._lookup(self.by_tmdb, ids)
+
+    def rows_by_movie(self, ids):
+
+        # Catalog rows of MovieLens ids, -1 for ids missing from the catalog
+
+        return self._lookup(self.by_movie, ids)
+
+    def voted(self):
+
+        # Rows that also have vote statistics, i.e. desc_movies inner joined with desc2_movies
+
+        return self.table[self.table['voted'].to_numpy()]
+
+    def render(self, rows):
+
+        # Display dicts of the given rows in order, rows without a poster are skipped.
+        # Cast is the list of cast members, looked up in the casts token table
+
+        rows = np.asarray(rows)
+        res = self.table.iloc[rows[rows >= 0]]
+        res = res[res['posters'].notna()]
+        return [{'Title': i[0], 'Overview': i[1], 'Poster': i[2], 'Cast': self.casts.get(i[3])}
+                for i in res[['title', 'overview', 'posters', 'tmdbId']].values]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the pre-joined movie catalog from the scraped TMDb datasets.')
+    parser.add_argument('--output', default=CATALOG_FILE)
+    args = parser.parse_args()
+
+    from utils import datasets
+
+    try:
+        casts = tokens.TokenTable.load('casts')
+    except FileNotFoundError:
+        casts = None
+    catalog = Catalog.build(datasets.read('desc_movies'), datasets.read('desc2_movies'), datasets.read('posters'), datasets.read('links'), casts)
+    catalog.save(args.output)
+    print('Saved', len(catalog), 'movies to', args.output)
@@ -0,0 +1,114 @@
+import streamlit as st
+from utils import store
+from utils import datasets
+from utils import shared
+from utils import tokens as token_tables
+from utils import leaderboard
+from utils.catalog import Catalog
+from utils.catalog import CATALOG_FILE
+
+# Shared, lazily loaded datasets
+# Every accessor reads its table (see utils/datasets.py) on first use only, with declared
+# dtypes and an optional column subset, and is cached once for all pages. Frames are cached as
+# resources, shared by all sessions without being copied on every access, and must not be
+# modified. With [Shared] enabled in env.config the prebuilt artifacts are mapped from the
+# host-wide copies (see utils/shared.py) instead of the local store
+
+DATASETS = datasets.DATASETS
+read = datasets.read
+
+
+@st.cache_resource
+def load(name, columns=None):
+    return read(name, columns)
+
+
+@st.cache_resource
+def columns(name):
+    return datasets.columns(name)
+
+
+@st.cache_resource
+def roots():
+
+    # Store and model roots of this process, published to shared memory first when enabled
+
+    return shared.attach('env.config')
+
+
+@st.cache_resource
+def ratings():
+
+    # Mapped from the columnar store, cached as a resource so it is never copied
+
+    return store.load_ratings('./data/ratings.csv', roots()['store'])
+
+
+@st.cache_resource
+def catalog():
+
+    # Pre-joined catalog, mapped from the shared root, built by 'python -m utils.catalog' or
+    # joined once per process. It is shared between sessions and must not be modified
+
+    try:
+        return Catalog.attach(roots()['store'])
+    except FileNotFoundError:
+        pass
+    try:
+        return Catalog.load(CATALOG_FILE)
+    except FileNotFoundError:
+        return Catalog.build(read('desc_movies'), read('desc2_movies'), read('posters'), read('links'), tokens('casts'))
+
+
+@st.cache_resource
+def tokens(name):
+
+    # Token table of casts, keywords or trailers, built by 'python -m utils.tokens' or parsed once per process
+
+    try:
+        return token_tables.TokenTable.load(name, roots()['store'])
+    except FileNotFoundError:
+        return token_tables.build(name, read)
+
+
+@st.cache_resource
+def leaderboards():
+
+    # Popularity leaderboards, built by 'python -m utils.leaderboard' or once per process from the catalog
+
+    try:
+        return leaderboard.load(catalog(), roots()['store'] + '/leaderboards.pkl')
+    except FileNotFoundError:
+        return leaderboard.build(catalog(), load('genres'))
+
+
+def links(columns=None):
+    return load('links', columns)
+
+
+def movies(columns=None):
+    return load('movies', columns)
+
+
+def genres(columns=None):
+    return load('genres', columns)
+
+
+def posters(columns=None):
+    return load('posters', columns)
+
+
+def trailers(columns=None):
+    return load('trailers', columns)
+
+
+def desc_movies(columns=None):
+    return load('desc_movies', columns)
+
+
+def desc2_movies(columns=None):
+    return load('desc2_movies', columns)
+
+
+def contents(columns=None):
+    return load('contents', columns)
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# Dataset definitions and the uncached reader
+# The csv files with their declared dtypes, read without Streamlit so the offline CLIs and the
+# recommendation service can use them, utils/data.py caches them for the pages
+
+DATASETS = {
+    'links': {
+        'file': './data/links.csv',
+        'dtype': {'movieId': np.int32, 'imdbId': np.int32, 'tmdbId': np.float64},
+    },
+    'movies': {
+        'file': './data/movies.csv',
+        'dtype': {'movieId': np.int32, 'title': str, 'genres': 'category'},
+    },
+    'genres': {
+        'file': './data/genres.csv',
+        'dtype': {'movieId': np.int32, 'title': str},
+        'default': np.uint8,                                          # One-hot genre columns
+    },
+    'posters': {
+        'file': './data/posters.csv',
+        'dtype': {'posters': str},
+        'scraped': True,
+    },
+    'trailers': {
+        'file': './data/trailers.csv',
+        'dtype': {'trailers': str},
+        'scraped': True,
+    },
+    'desc_movies': {
+        'file': './data/desc_movies.csv',
+        'dtype': {'title': str, 'overview': str, 'popularity': np.float32, 'casts': str},
+        'scraped': True,
+    },
+    'desc2_movies': {
+        'file': './data/desc2_movies.csv',
+        'dtype': {'vote_count': np.float32, 'vote_average': np.float32, 'keywords': str},
+        'scraped': True,
+    },
+    'contents': {
+        'file': './data/contents.csv',
+        'dtype': {'title': str, 'overview': str, 'casts': str},
+        'scraped': True,
+    },
+}
+
+
+def _read(spec, columns, **kwargs):
+    dtype = dict(spec['dtype'])
+    if 'default' in spec:
+        header = pd.read_csv(spec['file'], nrows=0, **kwargs).columns
+        dtype = {col: dtype.get(col, spec['default']) for col in header}
+    if columns is not None:
+        dtype = {col: val for col, val in dtype.items() if col in columns}
+    return pd.read_csv(spec['file'], usecols=columns, dtype=dtype, **kwargs)
+
+
+def columns(name):
+
+    # Column names of a dataset, from its header only
+
+    return list(pd.read_csv(DATASETS[name]['file'], nrows=0).columns)
+
+
+def read(name, columns=None):
+
+    # Reads a dataset without caching, the scraped ones may contain carriage returns inside text fields
+
+    spec = DATASETS[name]
+    columns = list(columns) if columns is not None else None
+    try:
+        return _read(spec, columns)
+    except Exception:
+        if not spec.get('scraped'):
+            raise
+        return _read(spec, columns, lineterminator='\n')
@@ -0,0 +1,216 @@
+import re
+import hashlib
+import argparse
+import unicodedata
+import numpy as np
+from scipy import sparse
+from utils import store
+
+# Serving-side replacement for the fitted CountVectorizer in systems/count.pkl
+# The vocabulary is kept as its concatenated UTF-8 terms with int32 offsets, like the Arrow
+# string buffers of utils/catalog.py, sorted by a 64-bit hash of the term next to their column
+# ids, so it can be memory-mapped and a whole batch of documents is looked up with a single
+# binary search over the hashes, every hit then being compared with the term bytes.
+# Preprocessing, tokenization, stop words and n-grams follow sklearn's 'word' analyzer, so
+# transform() returns the same matrix as count.transform()
+
+FEATURIZER_ROOT = './systems'
+FEATURIZER_NAME = 'count'
+FEATURIZER_VERSION = 2
+DOCUMENT_COLUMNS = ['title', 'overview', 'casts']                    # Columns of contents.csv the vectorizer was fitted on
+
+
+def _strip_accents_unicode(s):
+    try:
+        s.encode('ASCII', errors='strict')
+        return s
+    except UnicodeEncodeError:
+        normalized = unicodedata.normalize('NFKD', s)
+        return ''.join([c for c in normalized if not unicodedata.combining(c)])
+
+
+def _strip_accents_ascii(s):
+    return unicodedata.normalize('NFKD', s).encode('ASCII', 'ignore').decode('ASCII')
+
+
+STRIP_ACCENTS = {None: None, 'unicode': _strip_accents_unicode, 'ascii': _strip_accents_ascii}
+
+
+def _hash(terms):
+
+    # 64-bit hashes of UTF-8 encoded terms
+
+    return np.frombuffer(b''.join(hashlib.blake2b(t, digest_size=8).digest() for t in terms), dtype='<u8').astype(np.uint64)
+
+
+def _encode_terms(terms):
+
+    # Hashes, int32 offsets and concatenated UTF-8 bytes of the terms sorted by hash, and that order
+
+    encoded = [t.encode('utf-8') for t in terms]
+    hashes = _hash(encoded)
+    order = np.argsort(hashes, kind='stable')
+    hashes = hashes[order]
+    if len(hashes) and np.any(hashes[1:] == hashes[:-1]):
+        raise ValueError('Two terms of the vocabulary have the same hash')
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(encoded[i]) for i in order], out=offsets[1:])
+    if offsets[-1] > np.iinfo(np.int32).max:
+        raise ValueError('Vocabulary too large for int32 offsets')
+    data = np.frombuffer(b''.join(encoded[i] for i in order), dtype=np.uint8)
+    return hashes, offsets.astype(np.int32), data, order
+
+
+def documents(contents, columns=DOCUMENT_COLUMNS):
+
+    # The documents the vectorizer was fitted on, the text columns of contents joined by spaces
+
+    return contents[columns].fillna('').astype(str).agg(' '.join, axis=1).tolist()
+
+
+class Featurizer:
+
+    def __init__(self, hashes, offsets, data, columns, stop_words, token_pattern, lowercase=True, strip_accents=None,
+                 ngram_range=(1, 1), binary=False, dtype='int64', n_features=None):
+        self.hashes = hashes
+        self.offsets = offsets
+        self.data = data
+        self.columns = columns
+        self.stop_words = frozenset(store.decode_strings(stop_words)) if len(stop_words) else None
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self.strip_accents = strip_accents
+        self.ngram_range = tuple(ngram_range)
+        self.binary = binary
+        self.dtype = np.dtype(dtype)
+        self.n_features = int(columns.max()) + 1 if n_features is None else n_features
+        self._token = re.compile(token_pattern)
+        self._accents = STRIP_ACCENTS[strip_accents]
+
+    @classmethod
+    def from_vectorizer(cls, vectorizer):
+        if vectorizer.analyzer != 'word' or vectorizer.tokenizer is not None or vectorizer.preprocessor is not None:
+            raise ValueError('Only the default word analyzer is supported')
+        if vectorizer.input != 'content' or vectorizer.strip_accents not in STRIP_ACCENTS:
+            raise ValueError('Unsupported input or strip_accents setting')
+        vocabulary = vectorizer.vocabulary_
+        hashes, offsets, data, order = _encode_terms(list(vocabulary))
+        columns = np.fromiter(vocabulary.values(), dtype=np.int32, count=len(vocabulary))
+        stop_words = vectorizer.get_stop_words()
+        return cls(hashes, offsets, data, columns[order], store.encode_strings(sorted(stop_words or [])), vectorizer.token_pattern,
+                   vectorizer.lowercase, vectorizer.strip_accents, vectorizer.ngram_range, vectorizer.binary,
+                   np.dtype(vectorizer.dtype).name, len(vocabulary))
+
+    @classmethod
+    def load(cls, root=FEATURIZER_ROOT, name=FEATURIZER_NAME):
+        meta = store.read_meta(name, root)
+        if meta.get('model') != 'count' or meta.get('model_version') != FEATURIZER_VERSION:
+            raise ValueError('Unsupported featurizer artifact ' + store.table_path(name, root))
+        arrays = store.open_table(name, root)
+        return cls(arrays['terms.hash'], arrays['terms.offsets'], arrays['terms.data'], arrays['columns'], arrays['stop_words'], meta['token_pattern'], meta['lowercase'],
+                   meta['strip_accents'], meta['ngram_range'], meta['binary'], meta['dtype'], meta['n_features'])
+
+    def save(self, root=FEATURIZER_ROOT, name=FEATURIZER_NAME):
+        arrays = {'terms.hash': self.hashes, 'terms.offsets': self.offsets, 'terms.data': self.data, 'columns': self.columns, 'stop_words': store.encode_strings(sorted(self.stop_words or []))}
+        meta = {
+            'model': 'count', 'model_version': FEATURIZER_VERSION, 'token_pattern': self.token_pattern,
+            'lowercase': self.lowercase, 'strip_accents': self.strip_accents, 'ngram_range': list(self.ngram_range),
+            'binary': self.binary, 'dtype': self.dtype.name, 'n_features': self.n_features,
+        }
+        return store.write_arrays(name, arrays, meta, root)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def term(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]])
+
+    def lookup(self, tokens):
+
+        # Column of every token, -1 for the tokens out of the vocabulary
+
+        encoded = [t.encode('utf-8') for t in tokens]
+        res = np.full(len(encoded), -1, dtype=np.int64)
+        if not len(self.hashes) or not encoded:
+            return res
+        hashes = _hash(encoded)
+        pos = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        for i in np.flatnonzero(self.hashes[pos] == hashes):
+            if self.term(pos[i]) == encoded[i]:
+                res[i] = self.columns[pos[i]]
+        return res
+
+    def analyze(self, doc):
+
+        # Preprocessing, tokenization, stop word removal and n-grams of one document
+
+        if self.lowercase:
+            doc = doc.lower()
+        if self._accents is not None:
+            doc = self._accents(doc)
+        tokens = self._token.findall(doc)
+        if self.stop_words is not None:
+            tokens = [w for w in tokens if w not in self.stop_words]
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return tokens
+        original = tokens
+        if min_n == 1:
+            tokens = list(original)
+            min_n += 1
+        else:
+            tokens = []
+        for n in range(min_n, min(max_n + 1, len(original) + 1)):
+            for i in range(len(original) - n + 1):
+                tokens.append(' '.join(original[i:i + n]))
+        return tokens
+
+    def transform(self, docs):
+
+        # Document-term count matrix of a batch of documents
+
+        tokens, lengths = [], []
+        for doc in docs:
+            analyzed = self.analyze(doc)
+            tokens.extend(analyzed)
+            lengths.append(len(analyzed))
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        cols = self.lookup(tokens)
+        found = cols >= 0
+        rows, cols = rows[found], cols[found]
+        matrix = sparse.coo_matrix((np.ones(len(rows), dtype=self.dtype), (rows, cols)),
+                                   shape=(len(lengths), self.n_features)).tocsr()
+        matrix.sort_indices()
+        if self.binary:
+            matrix.data.fill(1)
+        return matrix
+
+
+def verify(vectorizer, featurizer, docs):
+
+    # Number of documents whose featurized row differs from count.transform
+
+    expected = vectorizer.transform(docs).tocsr()
+    actual = featurizer.transform(docs)
+    return int(np.count_nonzero(np.asarray(abs(expected - actual).sum(axis=1)).ravel()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the fitted CountVectorizer as a memory-mappable vocabulary.')
+    parser.add_argument('--pickle', default='./systems/count.pkl')
+    parser.add_argument('--root', default=FEATURIZER_ROOT)
+    parser.add_argument('--name', default=FEATURIZER_NAME)
+    parser.add_argument('--docs', default='./data/contents.csv', help='csv of the documents the vectorizer was fitted on, for the round-trip check')
+    parser.add_argument('--columns', nargs='+', default=DOCUMENT_COLUMNS, help='text columns joined into one document')
+    args = parser.parse_args()
+
+    import joblib
+    import pandas as pd
+
+    vectorizer = joblib.load(args.pickle)
+    Featurizer.from_vectorizer(vectorizer).save(args.root, args.name)
+    docs = documents(pd.read_csv(args.docs, usecols=args.columns, lineterminator='\n'), args.columns)
+    mismatches = verify(vectorizer, Featurizer.load(args.root, args.name), docs)
+    print('Exported', store.table_path(args.name, args.root), '-', mismatches, 'of', len(docs), 'documents differ from count.transform')
+    if mismatches:
+        raise SystemExit('Round-trip check against ' + args.pickle + ' failed')
@@ -0,0 +1,179 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from utils import store
+from utils import shared
+from utils import scoring
+
+# Incremental updates of the SVD model without retraining
+# Users and items the model has never seen get their factors (and biases) from a ridge
+# regression of their ratings against the fixed factors of the other side, then a few small
+# mini-batch SGD passes with the update rules of surprise's SVD apply every new rating to
+# both sides. The global mean stays the one of the training set. The model is read from and
+# written back as the exported arrays of utils/scoring.py, swapped in as a whole so serving
+# processes map either the old or the new model, and the last folded rating timestamp is
+# kept in its meta.json so the next run only picks up what came after. With a shared root
+# (see utils/shared.py) the new model is republished right away
+
+LR = 0.005
+REG = 0.02
+EPOCHS = 3
+BATCH = 1024
+BLOCK = 256                                                           # Rows solved together by the fold-in
+
+
+def _extend(ids, new, start):
+
+    # IdMap with the new raw ids appended as inner ids start, start + 1, ...
+
+    raw = np.concatenate([np.asarray(ids.raw, dtype=np.int64), new])
+    inner = np.concatenate([np.asarray(ids.inner, dtype=np.int32), np.arange(start, start + len(new), dtype=np.int32)])
+    order = np.argsort(raw, kind='stable')
+    return scoring.IdMap(raw[order], inner[order])
+
+
+def _fold(rows, cols, residuals, fixed, n, reg, biased, block=BLOCK):
+
+    # Factors and biases of n new rows from their residual ratings of columns with fixed factors.
+    # The ridge normal equations of a block of rows are accumulated from their ratings and solved
+    # as one stacked system, rows without any rating get zeros, i.e. the global mean as before
+
+    k = fixed.shape[1]
+    d = k + 1 if biased else k
+    chunk = max(1, (1 << 22) // (d * d))                              # Ratings whose outer products are built at once
+    factors = np.zeros((n, k))
+    biases = np.zeros(n)
+    order = np.argsort(rows, kind='stable')
+    rows, cols, residuals = rows[order], cols[order], residuals[order]
+    for lo in range(0, n, block):
+        hi = min(lo + block, n)
+        A = np.tile(reg * np.eye(d), (hi - lo, 1, 1))
+        B = np.zeros((hi - lo, d))
+        first, last = np.searchsorted(rows, [lo, hi])
+        for start in range(first, last, chunk):
+            stop = min(start + chunk, last)
+            X = np.asarray(fixed[cols[start:stop]], dtype=np.float64)
+            if biased:
+                X = np.column_stack([X, np.ones(stop - start)])
+            local = rows[start:stop] - lo
+            np.add.at(A, local, np.einsum('ij,ik->ijk', X, X))
+            np.add.at(B, local, X * residuals[start:stop, None])
+        w = np.linalg.solve(A, B[:, :, None])[:, :, 0]
+        factors[lo:hi] = w[:, :k]
+        if biased:
+            biases[lo:hi] = w[:, -1]
+    return factors, biases
+
+
+def update(scorer, users, items, ratings, lr=LR, reg=REG, epochs=EPOCHS, batch=BATCH, seed=0):
+
+    # Returns a new scorer with the unknown users and items folded in and the ratings applied,
+    # the given scorer (possibly mapped read-only) is left untouched
+
+    users = np.asarray(users, dtype=np.int64)
+    items = np.asarray(items, dtype=np.int64)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    pu, qi = np.array(scorer.pu, dtype=np.float64), np.array(scorer.qi, dtype=np.float64)
+    bu, bi = np.array(scorer.bu, dtype=np.float64), np.array(scorer.bi, dtype=np.float64)
+    mu, biased = scorer.global_mean, scorer.biased
+    known_users, known_items = len(pu), len(qi)
+
+    new_users = np.setdiff1d(users, scorer.users.raw)
+    new_items = np.setdiff1d(items, scorer.items.raw)
+    user_map = _extend(scorer.users, new_users, known_users)
+    item_map = _extend(scorer.items, new_items, known_items)
+    u, i = user_map.lookup(users), item_map.lookup(items)
+
+    # New users against the items of the model
+    sel = (u >= known_users) & (i < known_items)
+    residuals = ratings[sel] - mu - (bi[i[sel]] if biased else 0)
+    factors, biases = _fold(u[sel] - known_users, i[sel], residuals, qi, len(new_users), reg, biased)
+    pu, bu = np.vstack([pu, factors]), np.concatenate([bu, biases])
+
+    # New items against every user, the users folded in above included
+    sel = i >= known_items
+    residuals = ratings[sel] - mu - (bu[u[sel]] if biased else 0)
+    factors, biases = _fold(i[sel] - known_items, u[sel], residuals, pu, len(new_items), reg, biased)
+    qi, bi = np.vstack([qi, factors]), np.concatenate([bi, biases])
+
+    # SGD passes over the new ratings, gradients of a batch are summed per user and item
+    rng = np.random.default_rng(seed)
+    for _ in range(epochs):
+        order = rng.permutation(len(ratings))
+        for start in range(0, len(order), batch):
+            rows = order[start:start + batch]
+            uu, ii = u[rows], i[rows]
+            p, q = pu[uu], qi[ii]
+            est = mu + np.einsum('ij,ij->i', p, q)
+            if biased:
+                est += bu[uu] + bi[ii]
+            err = ratings[rows] - est
+            if biased:
+                np.add.at(bu, uu, lr * (err - reg * bu[uu]))
+                np.add.at(bi, ii, lr * (err - reg * bi[ii]))
+            np.add.at(pu, uu, lr * (err[:, None] * q - reg * p))
+            np.add.at(qi, ii, lr * (err[:, None] * p - reg * q))
+
+    return scoring.SVDScorer(pu.astype(scorer.pu.dtype), qi.astype(scorer.qi.dtype), bu.astype(scorer.bu.dtype),
+                             bi.astype(scorer.bi.dtype), mu, scorer.rating_scale, biased, user_map, item_map)
+
+
+def rmse(scorer, users, items, ratings):
+    return float(np.sqrt(np.mean((scorer.predict(users, items) - np.asarray(ratings, dtype=np.float64)) ** 2))) if len(ratings) else 0.0
+
+
+def new_ratings(since, root=store.STORE_DIR, filename=None):
+
+    # (users, items, ratings, last timestamp) rated after since, from a csv or the ratings store
+
+    if filename is not None:
+        frame = pd.read_csv(filename, dtype=store.RATINGS_SCHEMA)
+        table = {col: frame[col].to_numpy() for col in frame.columns}
+    else:
+        table = store.open_table('ratings', root)
+    if 'timestamp' in table and since is not None:
+        keep = np.asarray(table['timestamp']) > since
+    else:
+        keep = np.ones(len(table['rating']), dtype=bool)
+    last = int(np.asarray(table['timestamp'])[keep].max()) if 'timestamp' in table and keep.any() else since
+    return np.asarray(table['userId'])[keep], np.asarray(table['movieId'])[keep], np.asarray(table['rating'])[keep], last
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Folds new users, items and ratings into the exported SVD model without retraining.')
+    parser.add_argument('--root', default=scoring.MODEL_ROOT)
+    parser.add_argument('--store', default=None, help='ratings store root, the local one by default')
+    parser.add_argument('--name', default=scoring.MODEL_NAME)
+    parser.add_argument('--ratings', default=None, help='csv of userId,movieId,rating[,timestamp], the ratings store by default')
+    parser.add_argument('--since', type=int, default=None, help='only ratings after this timestamp, defaults to the last folded one')
+    parser.add_argument('--output', default=None, help='model name to write, the input model by default')
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--lr', type=float, default=LR)
+    parser.add_argument('--reg', type=float, default=REG)
+    parser.add_argument('--batch', type=int, default=BATCH)
+    args = parser.parse_args()
+
+    meta = store.read_meta(args.name, args.root)
+    since = args.since if args.since is not None else meta.get('ratings_until')
+    if since is None and args.ratings is None:
+        raise SystemExit('No fold-in yet: pass --since with the last timestamp of the training ratings, or --ratings')
+
+    start = time.time()
+    scorer = scoring.SVDScorer.load(args.root, args.name)
+    users, items, ratings, last = new_ratings(since, args.store or shared.roots()['store'], args.ratings)
+    if not len(ratings):
+        raise SystemExit('No new ratings since ' + str(since))
+    before = rmse(scorer, users, items, ratings)
+    updated = update(scorer, users, items, ratings, args.lr, args.reg, args.epochs, args.batch)
+    after = rmse(updated, users, items, ratings)
+    folded = {'ratings_until': last, 'folded_users': len(updated.users) - len(scorer.users) + meta.get('folded_users', 0),
+              'folded_items': len(updated.items) - len(scorer.items) + meta.get('folded_items', 0)}
+    del scorer
+    updated.save(args.root, args.output or args.name, folded)
+    written = shared.refresh()                                        # Serving processes of a shared root reload from the copies
+    print('Folded', len(ratings), 'ratings,', folded['folded_users'], 'users and', folded['folded_items'], 'items in total into',
+          store.table_path(args.output or args.name, args.root), '- RMSE on them', round(before, 4), '->', round(after, 4),
+          'in', round(time.time() - start, 1), 's')
+    if written:
+        print('Republished', ', '.join(written))
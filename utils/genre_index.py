@@ -0,0 +1,110 @@
+import argparse
+import numpy as np
+import pandas as pd
+from utils import store
+
+# Per-movie genre bitmask and rating aggregates
+# Every movie gets one integer whose bit j is set when it has the j-th genre column of
+# genres.csv, next to its number of ratings and mean rating, so selecting candidates for a
+# genre list is a vectorized AND over the movies instead of merges against all ratings
+
+# TMDb genre words that are named differently in MovieLens
+ALIASES = {
+    'family': 'Children',
+    'music': 'Musical',
+    'science': 'Sci-Fi',
+    'scifi': 'Sci-Fi',
+    'noir': 'Film-Noir',
+}
+
+
+class GenreIndex:
+
+    def __init__(self, names, movie_ids, bits, counts, means):
+        self.names = list(names)
+        self.movie_ids = movie_ids
+        self.bits = bits
+        self.counts = counts
+        self.means = means
+        self._lookup = {name.lower(): j for j, name in enumerate(self.names)}
+
+    @classmethod
+    def build(cls, genres, rating_movie_ids, ratings):
+
+        # genres is the one-hot genres.csv frame, the ratings are given as two aligned columns
+
+        names = list(genres.columns[2:])
+        if len(names) > 32:
+            raise ValueError('At most 32 genres fit in the bitmask, got ' + str(len(names)))
+        onehot = genres[names].to_numpy(dtype=np.uint32)
+        bits = (onehot << np.arange(len(names), dtype=np.uint32)).sum(axis=1).astype(np.uint32)
+        movie_ids = genres['movieId'].to_numpy(dtype=np.int32)
+
+        rating_movie_ids = np.asarray(rating_movie_ids)
+        size = max(int(movie_ids.max()), int(rating_movie_ids.max()) if len(rating_movie_ids) else 0) + 1
+        counts = np.bincount(rating_movie_ids, minlength=size)
+        sums = np.bincount(rating_movie_ids, weights=np.asarray(ratings, dtype=np.float64), minlength=size)
+        counts, sums = counts[movie_ids], sums[movie_ids]
+        means = np.divide(sums, counts, out=np.zeros(len(sums)), where=counts > 0)
+        return cls(names, movie_ids, bits, counts.astype(np.int32), means.astype(np.float32))
+
+    @classmethod
+    def load(cls, root=store.STORE_DIR):
+        meta = store.read_meta('movie_genres', root)
+        table = store.open_table('movie_genres', root)
+        return cls(meta['genres'], table['movieId'], table['genres'], table['count'], table['mean'])
+
+    def save(self, root=store.STORE_DIR):
+        return store.write_table('movie_genres', {'movieId': self.movie_ids, 'genres': self.bits, 'count': self.counts, 'mean': self.means},
+                                 {'genres': self.names}, root)
+
+    def mask(self, names):
+
+        # Bitmask of a list of genre names, names unknown to MovieLens are ignored
+
+        mask = 0
+        for name in names:
+            name = ALIASES.get(name.lower(), name).lower()
+            if name in self._lookup:
+                mask |= 1 << self._lookup[name]
+        return np.uint32(mask)
+
+    def candidates(self, names, movie_ids=None):
+
+        # Rated movies having any of the genres (all of them when none is recognised),
+        # optionally restricted to the given movie ids, most rated first
+
+        mask = self.mask(names or [])
+        keep = self.counts > 0
+        if mask:
+            keep &= (self.bits & mask) != 0
+        if movie_ids is not None:
+            keep &= np.isin(self.movie_ids, movie_ids)
+        rows = np.flatnonzero(keep)
+        rows = rows[np.argsort(-self.counts[rows], kind='stable')]
+        return self.movie_ids[rows]
+
+    def genres_of(self, movie_ids):
+
+        # Lowercase names of the genres any of the given movies has, in column order
+
+        bits = np.bitwise_or.reduce(self.bits[np.isin(self.movie_ids, movie_ids)], initial=np.uint32(0))
+        return [name.lower() for j, name in enumerate(self.names) if int(bits) >> j & 1]
+
+    def frame(self):
+
+        # Aggregates as a DataFrame, e.g. for exploration
+
+        return pd.DataFrame({'movieId': self.movie_ids, 'count': self.counts, 'mean': self.means})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the per-movie genre bitmask and rating aggregates.')
+    parser.add_argument('--genres', default='./data/genres.csv')
+    parser.add_argument('--root', default=store.STORE_DIR)
+    args = parser.parse_args()
+
+    ratings = store.open_table('ratings', args.root, ['movieId', 'rating'])
+    index = GenreIndex.build(pd.read_csv(args.genres), ratings['movieId'], ratings['rating'])
+    index.save(args.root)
+    print('Saved', len(index.names), 'genres for', len(index.movie_ids), 'movies to', store.table_path('movie_genres', args.root))
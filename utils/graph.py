@@ -0,0 +1,128 @@
+import argparse
+import numpy as np
+from scipy import sparse
+from utils import store
+
+# Co-appearance graph of the cast members
+# As in the original network tab, the lead (first billed) actor of every movie with at least
+# two cast members is linked to each of their co-stars, weighted by the number of movies.
+# The graph is kept as a symmetric CSR adjacency over integer actor ids next to the actor
+# name table, persisted in the columnar store, so the neighbors of an actor are one slice
+
+GRAPH_NAME = 'coappearance'
+
+
+class CoappearanceGraph:
+
+    def __init__(self, indptr, indices, weights, names):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.names = names
+        self._ids = {name: i for i, name in enumerate(names)}
+
+    @classmethod
+    def from_edges(cls, leads, others, names):
+
+        # Adjacency of lead -> co-star pairs over the ids of names, unused names are left out
+
+        leads, others = np.asarray(leads, dtype=np.int32), np.asarray(others, dtype=np.int32)
+        used = np.unique(np.concatenate([leads, others]))
+        leads, others = np.searchsorted(used, leads), np.searchsorted(used, others)
+        n = len(used)
+        keep = leads != others
+        edges = sparse.coo_matrix((np.ones(int(keep.sum()), dtype=np.int32), (leads[keep], others[keep])), shape=(n, n))
+        adjacency = (edges + edges.T).tocsr()
+        adjacency.sum_duplicates()
+        adjacency.sort_indices()
+        return cls(adjacency.indptr.astype(np.int64), adjacency.indices.astype(np.int32), adjacency.data.astype(np.int32), [names[i] for i in used.tolist()])
+
+    @classmethod
+    def build(cls, casts):
+
+        # casts is an iterable of cast lists, one per movie, lead actor first
+
+        ids, leads, others = {}, [], []
+        for cast in casts:
+            if len(cast) < 2:
+                continue
+            members = [ids.setdefault(name, len(ids)) for name in cast]
+            leads += [members[0]] * (len(members) - 1)
+            others += members[1:]
+        return cls.from_edges(leads, others, list(ids))
+
+    @classmethod
+    def from_tokens(cls, casts):
+
+        # Builds from the casts token table of utils/tokens.py without parsing any strings
+
+        leads, others = casts.leads()
+        return cls.from_edges(leads, others, casts.vocab)
+
+    @classmethod
+    def load(cls, root=store.STORE_DIR, name=GRAPH_NAME):
+        arrays = store.open_table(name, root)
+        return cls(arrays['indptr'], arrays['indices'], arrays['weights'], store.decode_strings(arrays['names']))
+
+    def save(self, root=store.STORE_DIR, name=GRAPH_NAME):
+        arrays = {'indptr': self.indptr, 'indices': self.indices, 'weights': self.weights, 'names': store.encode_strings(self.names)}
+        return store.write_arrays(name, arrays, {'nodes': len(self.names), 'edges': len(self.indices) // 2}, root)
+
+    def __len__(self):
+        return len(self.names)
+
+    def id(self, name):
+        return self._ids[name]
+
+    def neighbors(self, node):
+
+        # Co-stars of an actor id and the number of movies they share
+
+        start, stop = self.indptr[node], self.indptr[node + 1]
+        return self.indices[start:stop], self.weights[start:stop]
+
+    def degree(self, node):
+        return int(self.indptr[node + 1] - self.indptr[node])
+
+    def ego(self, node, hops=1):
+
+        # Edges (sources, targets, weights) reached within the given number of hops from an actor,
+        # each undirected edge once. With one hop these are exactly the edges of the actor
+
+        visited = {node}
+        frontier = [node]
+        sources, targets, weights = [], [], []
+        for _ in range(hops):
+            reached = []
+            for u in frontier:
+                nbrs, w = self.neighbors(u)
+                sources.append(np.full(len(nbrs), u, dtype=np.int32))
+                targets.append(nbrs)
+                weights.append(w)
+                reached += [v for v in nbrs.tolist() if v not in visited]
+            visited.update(reached)
+            frontier = list(dict.fromkeys(reached))
+            if not frontier:
+                break
+        sources, targets, weights = np.concatenate(sources), np.concatenate(targets), np.concatenate(weights)
+        lo, hi = np.minimum(sources, targets), np.maximum(sources, targets)
+        _, first = np.unique(lo.astype(np.int64) * len(self.names) + hi, return_index=True)
+        first.sort()
+        return sources[first], targets[first], weights[first]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the cast co-appearance graph from desc_movies.')
+    parser.add_argument('--root', default=store.STORE_DIR)
+    args = parser.parse_args()
+
+    from utils import datasets
+    from utils import tokens
+
+    try:
+        casts = tokens.TokenTable.load('casts', args.root)
+    except FileNotFoundError:
+        casts = tokens.build('casts', datasets.read)
+    graph = CoappearanceGraph.from_tokens(casts)
+    info = graph.save(args.root)
+    print('Saved', info['nodes'], 'actors and', info['edges'], 'co-appearances to', store.table_path(GRAPH_NAME, args.root))
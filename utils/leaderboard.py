@@ -0,0 +1,79 @@
+import os
+import random
+import argparse
+import numpy as np
+import pandas as pd
+
+# Popularity leaderboards
+# The catalog rows of the top N most popular movies having a poster, overall and for every
+# genre column of genres.csv, so the Popularity tab only samples from a small prebuilt list
+# and renders the few sampled rows on every rerun. They are saved as TMDb ids and mapped
+# back to rows of the catalog they are loaded with
+
+LEADERBOARD_FILE = './data/store/leaderboards.pkl'
+LEADERBOARD_VERSION = 4
+ALL = 'All'
+
+
+def board(catalog, rows, n=500):
+
+    # The n most popular of the given catalog rows, those without a poster are left out
+
+    rows = np.asarray(rows)
+    rows = np.unique(rows[rows >= 0])
+    rows = rows[catalog.table['posters'].notna().to_numpy()[rows]]
+    return rows[np.argsort(-catalog.table['popularity'].values[rows], kind='stable')[:n]].astype(np.int32)
+
+
+def build(catalog, genres, n=500):
+    boards = {ALL: board(catalog, np.arange(len(catalog)), n)}
+    for gen in genres.columns[2:]:
+        boards[gen] = board(catalog, catalog.rows_by_movie(genres.loc[genres[gen] == 1, 'movieId']), n)
+    return boards
+
+
+def load(catalog, filename=LEADERBOARD_FILE):
+
+    # The saved TMDb ids are mapped to rows of the given catalog, so a rebuilt catalog never
+    # shifts a leaderboard onto other movies. Movies gone from the catalog or left without a
+    # poster are dropped
+
+    saved = pd.read_pickle(filename)
+    if saved.get('version') != LEADERBOARD_VERSION:
+        raise ValueError('Unsupported leaderboard version in ' + filename)
+    return {name: board(catalog, catalog.rows_by_tmdb(ids), len(ids)) for name, ids in saved['boards'].items()}
+
+
+def save(boards, catalog, filename=LEADERBOARD_FILE):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = filename + '.tmp'
+    tmdb = catalog.table['tmdbId'].to_numpy()
+    pd.to_pickle({'version': LEADERBOARD_VERSION, 'boards': {name: tmdb[rows] for name, rows in boards.items()}}, tmp)
+    os.replace(tmp, filename)
+
+
+def sample(boards, name, num):
+
+    # Catalog rows of a random selection of num movies from a leaderboard
+
+    rows = boards.get(name, [])
+    return np.asarray(random.sample(list(rows), min(num, len(rows))), dtype=np.int32)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the overall and per genre popularity leaderboards.')
+    parser.add_argument('--output', default=LEADERBOARD_FILE)
+    parser.add_argument('-n', type=int, default=500)
+    args = parser.parse_args()
+
+    from utils import datasets
+    from utils.catalog import Catalog
+    from utils.catalog import CATALOG_FILE
+
+    try:
+        catalog = Catalog.load(CATALOG_FILE)
+    except FileNotFoundError:
+        catalog = Catalog.build(datasets.read('desc_movies'), datasets.read('desc2_movies'), datasets.read('posters'), datasets.read('links'))
+    boards = build(catalog, datasets.read('genres'), args.n)
+    save(boards, catalog, args.output)
+    print('Saved', len(boards), 'leaderboards to', args.output)
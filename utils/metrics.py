@@ -0,0 +1,224 @@
+import os
+import time
+import tempfile
+import bisect
+import threading
+import functools
+import contextlib
+import configparser
+
+# Lightweight per-stage instrumentation
+# A process-wide registry of latency histograms (one per stage, fixed buckets), counters and
+# cache hit/miss counts. Stages are timed with `with metrics.timer('stage'):` or the @timed
+# decorator. The registry is shown in an optional sidebar panel of the pages, written as a
+# Prometheus text file per process at most every export_interval seconds, and served on
+# /metrics by utils/service.py
+
+PREFIX = 'movie_recommender'
+EXPORT_INTERVAL = 15.0
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def read_config(filename='env.config'):
+
+    # Panel and export settings from env.config, the [Metrics] section is optional
+
+    config = configparser.ConfigParser()
+    config.read(filename)
+    return {
+        'panel': config.getboolean('Metrics', 'panel', fallback=False),
+        'export': config.get('Metrics', 'export', fallback='') or None,
+        'export_interval': config.getfloat('Metrics', 'export_interval', fallback=EXPORT_INTERVAL),
+    }
+
+
+def export_path(filename, pid=None):
+
+    # One export file per process, e.g. metrics.prom -> metrics.1234.prom, so the workers of a
+    # host do not replace each other's registry and the textfile collector reads them all
+
+    base, ext = os.path.splitext(filename)
+    return base + '.' + str(os.getpid() if pid is None else pid) + ext
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)                        # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+
+        # Upper bound of the bucket holding the q-quantile
+
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return float('inf')
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._exported = None                                         # Monotonic time of the last export
+        self.histograms = {}
+        self.counters = {}
+        self.caches = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - began)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def cache(self, name, hit):
+
+        # Records a hit or a miss of a cache
+
+        with self._lock:
+            hits, misses = self.caches.get(name, (0, 0))
+            self.caches[name] = (hits + 1, misses) if hit else (hits, misses + 1)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.caches.clear()
+
+    def stages(self):
+
+        # One dict per stage with its count and latencies in milliseconds
+
+        with self._lock:
+            return [{'stage': stage, 'count': h.count, 'mean_ms': 1000 * h.sum / h.count if h.count else 0.0,
+                     'p50_ms': 1000 * h.quantile(0.5), 'p90_ms': 1000 * h.quantile(0.9), 'p99_ms': 1000 * h.quantile(0.99)}
+                    for stage, h in sorted(self.histograms.items())]
+
+    def hit_rates(self):
+        with self._lock:
+            return {name: {'hits': hits, 'misses': misses, 'rate': hits / (hits + misses) if hits + misses else 0.0}
+                    for name, (hits, misses) in sorted(self.caches.items())}
+
+    def prometheus(self):
+
+        # Prometheus text exposition format
+
+        lines = []
+        with self._lock:
+            name = PREFIX + '_stage_seconds'
+            lines += ['# HELP ' + name + ' Latency of the recommendation and visualization stages', '# TYPE ' + name + ' histogram']
+            for stage, h in sorted(self.histograms.items()):
+                seen = 0
+                for bound, count in zip(h.buckets + (float('inf'),), h.counts):
+                    seen += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(name + '_bucket{stage="' + stage + '",le="' + le + '"} ' + str(seen))
+                lines.append(name + '_sum{stage="' + stage + '"} ' + repr(h.sum))
+                lines.append(name + '_count{stage="' + stage + '"} ' + str(h.count))
+            name = PREFIX + '_events_total'
+            lines += ['# HELP ' + name + ' Counted events', '# TYPE ' + name + ' counter']
+            for event, value in sorted(self.counters.items()):
+                lines.append(name + '{event="' + event + '"} ' + str(value))
+            name = PREFIX + '_cache_requests_total'
+            lines += ['# HELP ' + name + ' Cache lookups by result', '# TYPE ' + name + ' counter']
+            for cache, (hits, misses) in sorted(self.caches.items()):
+                lines.append(name + '{cache="' + cache + '",result="hit"} ' + str(hits))
+                lines.append(name + '{cache="' + cache + '",result="miss"} ' + str(misses))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+
+        # Writes the Prometheus text atomically, e.g. for the node exporter's textfile collector
+
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory or '.', prefix=os.path.basename(filename) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.prometheus())
+            os.replace(tmp, filename)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def export(self, filename, interval=EXPORT_INTERVAL):
+
+        # Writes the export file of this process unless it was written less than interval seconds ago,
+        # returns whether it was written
+
+        now = time.monotonic()
+        with self._lock:
+            if self._exported is not None and now - self._exported < interval:
+                return False
+            self._exported = now
+        self.write(export_path(filename))
+        return True
+
+
+REGISTRY = Registry()
+timer = REGISTRY.timer
+count = REGISTRY.count
+cache = REGISTRY.cache
+
+
+def timed(stage):
+
+    # Decorator timing every call of a function as a stage
+
+    def wrap(fn):
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            with REGISTRY.timer(stage):
+                return fn(*args, **kwargs)
+        return call
+    return wrap
+
+
+def panel(config='env.config'):
+
+    # Sidebar panel of the stage latencies and cache hit rates when enabled in env.config,
+    # and the Prometheus file of this process when an export path is set. Called at the end of a page
+
+    settings = read_config(config)
+    if settings['export']:
+        REGISTRY.export(settings['export'], settings['export_interval'])
+    if not settings['panel']:
+        return
+    import pandas as pd
+    import streamlit as st
+
+    with st.sidebar.expander('Metrics'):
+        stages = REGISTRY.stages()
+        if stages:
+            st.dataframe(pd.DataFrame(stages).set_index('stage').round(2), use_container_width=True)
+        rates = REGISTRY.hit_rates()
+        if rates:
+            st.dataframe(pd.DataFrame(rates).T.round(3), use_container_width=True)
+        if not stages and not rates:
+            st.caption('Nothing measured yet')
@@ -0,0 +1,119 @@
+import os
+import time
+import argparse
+import numpy as np
+from multiprocessing import Pool
+from utils import store
+from utils.similarity import ContentIndex
+
+# Precomputed item-to-item content neighbors
+# Offline, every row of the count matrix is scored against the whole matrix in chunks spread
+# over all cores, and only the top N neighbors (including the title itself) are kept as a
+# compact table of int32 row ids and float16 similarities. The batch content job of
+# utils/batch.py scores its shards with the same functions, leaving the title itself out
+
+NEIGHBORS_FILE = './systems/neighbors.npz'
+NEIGHBORS_NAME = 'neighbors'
+
+_index = None
+_rows = None
+
+
+def init(filename):
+
+    # Loads the count matrix once per process, e.g. as a pool initializer
+
+    global _index, _rows
+    _index = ContentIndex.load(filename)
+    _rows = _index.matrix.tocsr()
+
+
+def top(start, stop, n, exclude_self=False):
+
+    # The n nearest titles of rows start:stop, without the title itself when exclude_self is set
+    # (the last neighbor is dropped instead when the title is not among them)
+
+    ids, scores = _index.query(_rows[start:stop], n + 1 if exclude_self else n)
+    if exclude_self:
+        rows = np.arange(start, stop)
+        keep = ids != rows[:, None]
+        keep[keep.all(axis=1), -1] = False
+        ids = ids[keep].reshape(len(rows), -1)[:, :n]
+        scores = scores[keep].reshape(len(rows), -1)[:, :n]
+    return ids.astype(np.int32), scores.astype(np.float16)
+
+
+def _chunk(task):
+    start, stop, n = task
+    ids, scores = top(start, stop, n)
+    return start, ids, scores
+
+
+def compute(filename='./systems/count_matrix.npz', n=50, chunksize=512, processes=None):
+
+    # Returns the (rows x n) neighbor ids and similarities of every title
+
+    init(filename)
+    rows = _index.shape[0]
+    n = min(n, rows)
+    ids = np.empty((rows, n), dtype=np.int32)
+    scores = np.empty((rows, n), dtype=np.float16)
+    tasks = [(start, min(start + chunksize, rows), n) for start in range(0, rows, chunksize)]
+    with Pool(processes or os.cpu_count(), initializer=init, initargs=(filename,)) as pool:
+        for start, chunk_ids, chunk_scores in pool.imap_unordered(_chunk, tasks):
+            ids[start:start + len(chunk_ids)] = chunk_ids
+            scores[start:start + len(chunk_scores)] = chunk_scores
+    return ids, scores
+
+
+def save(ids, scores, filename=NEIGHBORS_FILE):
+    tmp = filename + '.tmp.npz'
+    np.savez(tmp, ids=ids, scores=scores)
+    os.replace(tmp, filename)
+
+
+class NeighborIndex:
+
+    def __init__(self, ids, scores):
+        self.ids = ids
+        self.scores = scores
+
+    @classmethod
+    def load(cls, filename=NEIGHBORS_FILE):
+        with np.load(filename) as f:
+            return cls(f['ids'], f['scores'])
+
+    @classmethod
+    def attach(cls, root='./systems', name=NEIGHBORS_NAME):
+
+        # Maps the table written by save instead of reading the npz into memory
+
+        arrays = store.open_table(name, root)
+        return cls(arrays['ids'], arrays['scores'])
+
+    def save(self, root='./systems', name=NEIGHBORS_NAME):
+        return store.write_arrays(name, {'ids': self.ids, 'scores': self.scores}, {'rows': len(self.ids)}, root)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def lookup(self, row, k):
+
+        # Returns the k nearest titles of a catalog row, most similar first
+
+        return self.ids[row, :k], self.scores[row, :k]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precomputes the top N content neighbors of every title in the count matrix.')
+    parser.add_argument('--matrix', default='./systems/count_matrix.npz')
+    parser.add_argument('--output', default=NEIGHBORS_FILE)
+    parser.add_argument('-n', type=int, default=50)
+    parser.add_argument('--chunksize', type=int, default=512)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.time()
+    ids, scores = compute(args.matrix, args.n, args.chunksize, args.processes)
+    save(ids, scores, args.output)
+    print('Saved', ids.shape[1], 'neighbors for', ids.shape[0], 'titles to', args.output, 'in', round(time.time() - start, 1), 's')
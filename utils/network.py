@@ -0,0 +1,87 @@
+import functools
+import numpy as np
+
+# 3D layouts of actor ego networks for the co-appearance tab
+# An ego network is laid out once per actor and kept in an LRU cache. Node degrees come from
+# the ego edges themselves and the edge segments are gathered as NaN separated arrays.
+# Prolific actors are reduced to their top weight co-stars above max_nodes, and above
+# kk_limit nodes the O(n²) Kamada-Kawai layout gives way to Fruchterman-Reingold
+
+MAX_NODES = 150
+KK_LIMIT = 100
+
+
+def prune(sources, targets, weights, max_nodes=MAX_NODES):
+
+    # Keeps the heaviest edges, ties in their original order, for as long as they span at most max_nodes nodes
+
+    order = np.argsort(-np.asarray(weights), kind='stable')
+    ends = np.column_stack([sources[order], targets[order]]).ravel()
+    _, first = np.unique(ends, return_index=True)
+    spanned = np.bincount(first // 2, minlength=len(order)).cumsum()
+    keep = np.sort(order[:np.searchsorted(spanned, max_nodes, side='right')])
+    return sources[keep], targets[keep], weights[keep]
+
+
+class EgoLayout:
+
+    def __init__(self, nodes, edges, weights, coords, pruned, method):
+        self.nodes = nodes                                            # Graph ids, the chosen actor first
+        self.edges = edges                                            # (m, 2) positions into nodes
+        self.weights = weights
+        self.coords = coords                                          # (n, 3) node positions
+        self.pruned = pruned
+        self.method = method
+
+    def degrees(self):
+        return np.bincount(self.edges.ravel(), minlength=len(self.nodes))
+
+    def segments(self):
+
+        # x, y and z of every edge as start, end, NaN, so all edges form one line trace
+
+        ends = self.coords[self.edges]
+        gaps = np.full((len(self.edges), 1, 3), np.nan)
+        lines = np.concatenate([ends, gaps], axis=1).reshape(-1, 3)
+        return lines[:, 0], lines[:, 1], lines[:, 2]
+
+
+def ego_layout(graph, node, hops=1, max_nodes=MAX_NODES, kk_limit=KK_LIMIT):
+    sources, targets, weights = graph.ego(node, hops)
+    keep = sources != targets
+    sources, targets, weights = sources[keep], targets[keep], weights[keep]
+    pruned = len(np.union1d(sources, targets)) > max_nodes
+    if pruned:
+        sources, targets, weights = prune(sources, targets, weights, max_nodes)
+
+    nodes = np.concatenate([[node], sources, targets]).astype(np.int32)
+    _, first = np.unique(nodes, return_index=True)
+    nodes = nodes[np.sort(first)]
+    order = np.argsort(nodes)
+    edges = np.column_stack([order[np.searchsorted(nodes, sources, sorter=order)],
+                             order[np.searchsorted(nodes, targets, sorter=order)]]).astype(np.int32)
+
+    # igraph is only imported with the first layout
+    import igraph as ig
+
+    method = 'kk' if len(nodes) <= kk_limit else 'fr'
+    coords = np.asarray(ig.Graph(n=len(nodes), edges=edges.tolist()).layout(method, dim=3).coords, dtype=np.float64).reshape(-1, 3)
+    return EgoLayout(nodes, edges, weights, coords, pruned, method)
+
+
+class LayoutCache:
+
+    # Ego layouts of the most recently chosen actors, keyed by actor name
+
+    def __init__(self, graph, hops=1, max_nodes=MAX_NODES, kk_limit=KK_LIMIT, maxsize=64):
+        self.graph = graph
+        self.hops = hops
+        self.max_nodes = max_nodes
+        self.kk_limit = kk_limit
+        self.get = functools.lru_cache(maxsize=maxsize)(self._layout)
+
+    def _layout(self, actor):
+        return ego_layout(self.graph, self.graph.id(actor), self.hops, self.max_nodes, self.kk_limit)
+
+    def info(self):
+        return self.get.cache_info()
@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+import tempfile
+import pandas as pd
+
+# Sampled and persisted profiling reports for the Explore page
+# Reports are generated from a stratified sample of at most `sample` rows and saved as HTML
+# under a key made of the content hash of the dataset and the profiling settings, so a report
+# is only generated once for every version of a dataset and set of settings. Content hashes are
+# kept in hashes.json with the size and modification time of the files they were read from, so
+# a dataset is only hashed again once its files change
+
+PROFILE_DIR = './data/store/profiles'
+PROFILE_VERSION = 1
+
+SETTINGS = {
+    'sample': 100_000,                                                # Rows profiled, 0 profiles every row
+    'strata': None,                                                   # Column the sample is stratified on
+    'minimal': False,                                                 # Skips correlations and interactions
+    'seed': 0,
+}
+
+
+def fingerprint(df):
+
+    # Content hash of a DataFrame, its columns, dtypes and values
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def signature(paths):
+
+    # Size and modification time of the files a dataset is read from, missing ones included
+
+    res = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            res.append([path, stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            res.append([path, None, None])
+    return res
+
+
+def dataset_hash(name, files, load, root=PROFILE_DIR):
+
+    # Content hash of a dataset, reused while its files keep the signature it was computed for
+
+    path = os.path.join(root, 'hashes.json')
+    try:
+        with open(path) as f:
+            hashes = json.load(f)
+    except (FileNotFoundError, ValueError):
+        hashes = {}
+    current = signature(files)
+    entry = hashes.get(name)
+    if entry is not None and entry['signature'] == current:
+        return entry['hash']
+    res = fingerprint(load())
+    hashes[name] = {'signature': current, 'hash': res}
+    os.makedirs(root, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=root, prefix='hashes.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(hashes, f, indent=2)
+    os.replace(tmp, path)
+    return res
+
+
+def settings(**kwargs):
+    res = dict(SETTINGS)
+    res.update(kwargs)
+    return res
+
+
+def key(dataset_hash, settings):
+    config = json.dumps({'version': PROFILE_VERSION, 'settings': settings}, sort_keys=True, default=str)
+    return hashlib.sha1((dataset_hash + config).encode()).hexdigest()
+
+
+def sample(df, n, strata=None, seed=0):
+
+    # About n rows, every stratum keeping its share of the rows
+
+    if not n or len(df) <= n:
+        return df
+    if strata is None:
+        return df.sample(n, random_state=seed).sort_index()
+    return df.groupby(strata, observed=True, group_keys=False).sample(frac=n / len(df), random_state=seed).sort_index()
+
+
+def report_path(report_key, root=PROFILE_DIR):
+    return os.path.join(root, report_key + '.html')
+
+
+def cached(report_key, root=PROFILE_DIR):
+
+    # The saved report, None when it has not been generated yet
+
+    try:
+        with open(report_path(report_key, root), encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def generate(df, title, dataset, settings, report_key, root=PROFILE_DIR):
+
+    # Profiles the sample of df and saves the report html atomically
+
+    from ydata_profiling import ProfileReport
+
+    part = sample(df, settings['sample'], settings['strata'], settings['seed'])
+    if len(part) < len(df):
+        dataset = dict(dataset, description=dataset.get('description', '') + ' Profiled on a sample of ' + str(len(part)) + ' of ' + str(len(df)) + ' rows.')
+    profile = ProfileReport(part,
+                            title=title,
+                            dataset=dataset,
+                            explorative=not settings['minimal'],
+                            minimal=settings['minimal'],
+                            dark_mode=True,
+                            lazy=False)
+    html = profile.to_html()
+    os.makedirs(root, exist_ok=True)
+    path = report_path(report_key, root)
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(tmp, path)
+    return html
+
+
+def report(df, title, dataset, settings, dataset_hash=None, root=PROFILE_DIR):
+
+    # Saved report of df for the settings, generated on the first request only
+
+    report_key = key(dataset_hash or fingerprint(df), settings)
+    html = cached(report_key, root)
+    if html is None:
+        html = generate(df, title, dataset, settings, report_key, root)
+    return html
@@ -0,0 +1,86 @@
+import argparse
+import numpy as np
+from utils import store
+
+# Compressed rating indexes
+# The ratings are grouped by movie (movie -> users, ratings) and by user (user -> movies, ratings),
+# stored as an offsets array plus value arrays, so the entries of key k are the slice
+# values[indptr[k]:indptr[k + 1]]. Within a key the entries are sorted by rating, best first,
+# and the user index also keeps the users ordered by their number of ratings
+
+
+class RatingIndex:
+
+    def __init__(self, indptr, ids, ratings, active=None):
+        self.indptr = indptr
+        self.ids = ids
+        self.ratings = ratings
+        self.active = active
+
+    @classmethod
+    def build(cls, keys, ids, ratings, n_keys=None):
+        keys = np.asarray(keys)
+        n_keys = int(keys.max()) + 1 if n_keys is None else n_keys
+        order = np.lexsort((-np.asarray(ratings), keys))
+        indptr = np.zeros(n_keys + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=n_keys), out=indptr[1:])
+        counts = np.diff(indptr)
+        active = np.argsort(-counts, kind='stable').astype(np.int32)
+        return cls(indptr, np.asarray(ids)[order], np.asarray(ratings)[order], active[counts[active] > 0])
+
+    @classmethod
+    def load(cls, name, root=store.STORE_DIR):
+        arrays = store.open_table(name, root)
+        return cls(arrays['indptr'], arrays['ids'], arrays['ratings'], arrays['active'])
+
+    def save(self, name, root=store.STORE_DIR):
+        return store.write_arrays(name, {'indptr': self.indptr, 'ids': self.ids, 'ratings': self.ratings, 'active': self.active},
+                                  {'keys': len(self.indptr) - 1, 'entries': len(self.ids)}, root)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def count(self, key):
+        if key < 0 or key >= len(self):
+            return 0
+        return int(self.indptr[key + 1] - self.indptr[key])
+
+    def get(self, key):
+
+        # Returns the ids and ratings of a key, best rated first
+
+        if key < 0 or key >= len(self):
+            return self.ids[:0], self.ratings[:0]
+        start, stop = self.indptr[key], self.indptr[key + 1]
+        return self.ids[start:stop], self.ratings[start:stop]
+
+    def most_active(self, n):
+
+        # Keys with the most entries, e.g. the users who rated the most movies
+
+        return self.active[:n]
+
+
+def build(root=store.STORE_DIR):
+
+    # Builds both indexes from the ratings table of the columnar store
+
+    ratings = store.open_table('ratings', root)
+    by_movie = RatingIndex.build(ratings['movieId'], ratings['userId'], ratings['rating'])
+    by_movie.save('ratings_by_movie', root)
+    del by_movie
+    by_user = RatingIndex.build(ratings['userId'], ratings['movieId'], ratings['rating'])
+    by_user.save('ratings_by_user', root)
+
+
+def load(root=store.STORE_DIR):
+    return RatingIndex.load('ratings_by_movie', root), RatingIndex.load('ratings_by_user', root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the movie -> users and user -> movies rating indexes from the columnar store.')
+    parser.add_argument('--root', default=store.STORE_DIR)
+    args = parser.parse_args()
+
+    build(args.root)
+    print('Saved the rating indexes to', store.table_path('ratings_by_movie', args.root), 'and', store.table_path('ratings_by_user', args.root))
@@ -0,0 +1,394 @@
+import re
+import random
+import numpy as np
+from utils import metrics
+from utils import similarity
+from utils import featurizer
+from utils import neighbors
+from utils import scoring
+from utils import rating_index
+from utils import genre_index
+from utils import tmdb_cache
+from utils import leaderboard
+from utils import result_cache
+from utils import shared
+from utils.catalog import Catalog
+from utils.catalog import CATALOG_FILE
+
+# Popularity, content and collaborative recommenders without any UI
+# The models and indexes are loaded once into a Recommender, shared by the Recommend page and
+# the HTTP service (see utils/service.py). Results are TMDb ids with scores, rendered by the
+# caller through the catalog. Queries are resolved one by one (catalog lookup or TMDb) and
+# then scored in batches: one featurizer transform and similarity product for all content
+# queries, and one users x movies SVD block for all collaborative queries.
+# Results are kept in a ResultCache (see utils/result_cache.py) keyed by the normalized title
+# and the parameters, failed lookups are never cached. Collaborative results are sampled at
+# random, so only their candidate movies and users are cached. When an artifact under the
+# roots the Recommender was loaded from changes, the cache is dropped and everything reloaded
+
+MODEL_ROOT = './systems'
+STORE_ROOT = './data/store'
+
+
+# The mapped artifacts are read from root, which may be the shared root of utils/shared.py,
+# the pickle and npz fallbacks always come from MODEL_ROOT
+
+def load_count(root=MODEL_ROOT):
+
+    # Exported by 'python -m utils.featurizer' and mapped read-only, otherwise the fitted
+    # CountVectorizer is unpickled
+
+    try:
+        return featurizer.Featurizer.load(root, 'count')
+    except FileNotFoundError:
+        import joblib
+        return joblib.load(MODEL_ROOT + '/count.pkl')
+
+
+def load_scorer(root=MODEL_ROOT):
+
+    # Exported by 'python -m utils.scoring' and mapped read-only, otherwise the surprise
+    # model is unpickled and its factors pulled into numpy arrays
+
+    try:
+        return scoring.SVDScorer.load(root, 'svd')
+    except FileNotFoundError:
+        from surprise import dump
+        _, svd = dump.load(MODEL_ROOT + '/svd.pkl')
+        return scoring.SVDScorer.from_algo(svd)
+
+
+def load_content_index(root=MODEL_ROOT):
+
+    # Mapped when published by 'python -m utils.shared', otherwise normalized from the count matrix
+
+    try:
+        return similarity.ContentIndex.attach(root)
+    except FileNotFoundError:
+        return similarity.ContentIndex.load(MODEL_ROOT + '/count_matrix.npz')
+
+
+def load_neighbors(root=MODEL_ROOT):
+
+    # Precomputed by 'python -m utils.neighbors' and mapped when published, None when missing
+
+    try:
+        return neighbors.NeighborIndex.attach(root)
+    except FileNotFoundError:
+        pass
+    try:
+        return neighbors.NeighborIndex.load(neighbors.NEIGHBORS_FILE)
+    except FileNotFoundError:
+        return None
+
+
+def load_rating_indexes(root=STORE_ROOT):
+
+    # Built by 'python -m utils.rating_index', None when missing
+
+    try:
+        return rating_index.load(root)
+    except FileNotFoundError:
+        return None
+
+
+def load_genre_index(genres, ratings, root=STORE_ROOT):
+
+    # Built by 'python -m utils.genre_index', otherwise aggregated once from the ratings
+
+    try:
+        return genre_index.GenreIndex.load(root)
+    except FileNotFoundError:
+        ratings = ratings()
+        return genre_index.GenreIndex.build(genres, ratings['movieId'].values, ratings['rating'].values)
+
+
+def load_catalog(catalog, boards, genres, root=STORE_ROOT):
+
+    # Catalog and leaderboards as the pages load them, the given ones when nothing was built
+
+    try:
+        catalog = Catalog.attach(root)
+    except FileNotFoundError:
+        try:
+            catalog = Catalog.load(CATALOG_FILE)
+        except FileNotFoundError:
+            return catalog, boards
+    try:
+        return catalog, leaderboard.load(catalog, root + '/leaderboards.pkl')
+    except FileNotFoundError:
+        return catalog, leaderboard.build(catalog, genres)
+
+
+def artifacts(models=MODEL_ROOT, root=STORE_ROOT):
+
+    # Files read by the loaders above, the fingerprint of the result cache. Under a shared root the
+    # local sources are watched as well, the offline tools write there and reload republishes them
+
+    if (models, root) != (MODEL_ROOT, STORE_ROOT):
+        return artifacts(models, root) + artifacts()
+    return ([models + '/' + name + '/meta.json' for name in ('count', 'content', 'neighbors', 'svd')] +
+            [root + '/' + name + '/meta.json' for name in ('ratings_by_movie', 'ratings_by_user', 'movie_genres', 'catalog')] +
+            [root + '/leaderboards.pkl', MODEL_ROOT + '/count.pkl', MODEL_ROOT + '/count_matrix.npz', neighbors.NEIGHBORS_FILE,
+             MODEL_ROOT + '/svd.pkl', CATALOG_FILE])
+
+
+def load_tmdb(config='env.config'):
+
+    # Persistent TMDb cache, misses go through one pooled async client configured in the [TMDb] section
+
+    settings = tmdb_cache.read_config(config)
+    return tmdb_cache.TMDbCache(settings['filename'], settings['ttl'], settings['offline'], settings['api_key'],
+                                url=settings['url'], timeout=settings['timeout'], concurrency=settings['concurrency'])
+
+
+def overTitle(mov):
+
+    # Builds the query from only the title and overview of a search result
+
+    title = mov['title'].lower()
+    overview = mov['overview'].lower()
+    result = re.sub("[^a-zA-Z0-9 ]", "", title + ' ' + overview)
+    return mov['title'], result
+
+
+def descTitle(mov):
+
+    # Builds the query from title, overview, genres, casts and keywords of a movie
+
+    title = mov['title'].lower()
+    overview = mov['overview'].lower()
+    genres = ' '.join(i.lower() for i in mov['genres'])
+    casts = ' '.join(i.replace(' ', '').lower() for i in mov['casts'][:5])
+    keywords = ' '.join(i.replace(' ', '').lower() for i in mov['keywords'])
+    result = re.sub("[^a-zA-Z0-9 ]", "", title + ' ' + overview + ' ' +  casts + ' ' +  genres + ' ' +  keywords)
+    return mov['title'], result, genres
+
+
+class Query:
+
+    # A resolved title: its catalog row when it is one of the contents titles, otherwise the
+    # document built from TMDb. error is set when neither worked
+
+    def __init__(self, title, row=None, doc=None, genres=None, error=None):
+        self.title = title
+        self.row = row
+        self.doc = doc
+        self.genres = genres
+        self.error = error
+
+
+class Recommender:
+
+    def __init__(self, catalog, boards, contents, links, count, content_index, neighbor_index, scorer, rating_indexes, genre_idx, tmdb, ratings,
+                 results=None, sources=None):
+        self.catalog = catalog
+        self.boards = boards
+        self.count = count
+        self.content_index = content_index
+        self.neighbor_index = neighbor_index
+        self.scorer = scorer
+        self.rating_indexes = rating_indexes
+        self.genre_index = genre_idx
+        self.tmdb = tmdb
+        self.ratings = ratings                                        # Loads the ratings for the scans without rating indexes
+        self.results = results if results is not None else result_cache.ResultCache()
+        self.sources = sources                                        # (genres, models, root, config) the artifacts were loaded with
+        if sources is not None:
+            self.results.on_change = self.reload
+
+        # Contents is the sampled dataframe on which the vectorizer was fitted, its titles without the year
+        self.content_ids = contents['movieId'].to_numpy()
+        self.titles = contents['title'].str[:-7].to_numpy()
+        self._rows = {}
+        for row, title in enumerate(self.titles):
+            self._rows.setdefault(title.strip().lower(), row)
+
+        links = links[['movieId', 'tmdbId']].dropna()
+        self._movies = links.drop_duplicates('tmdbId').set_index('tmdbId')['movieId'].astype(np.int64)
+        self._links = links
+        self.content_movies = links[links['tmdbId'].isin(self.content_ids)]['movieId'].to_numpy(dtype=np.int64)
+
+    @classmethod
+    def load(cls, catalog, boards, contents, links, genres, ratings, config='env.config', models=MODEL_ROOT, root=STORE_ROOT):
+        settings = result_cache.read_config(config)
+        return cls(catalog, boards, contents, links, load_count(models),
+                   load_content_index(models), load_neighbors(models),
+                   load_scorer(models), load_rating_indexes(root), load_genre_index(genres, ratings, root), load_tmdb(config), ratings,
+                   result_cache.ResultCache(settings['maxsize'], settings['ttl'], artifacts(models, root)), (genres, models, root, config))
+
+    def reload(self):
+
+        # Reloads the models, indexes, catalog and leaderboards from the roots they were loaded from,
+        # republished first when they are shared. Everything is loaded before any of it is swapped
+        # in, requests in flight keep the old objects
+
+        genres, models, root, config = self.sources
+        with metrics.timer('recommender.reload'):
+            shared.refresh(config)
+            catalog, boards = load_catalog(self.catalog, self.boards, genres, root)
+            loaded = (catalog, boards, load_count(models), load_content_index(models), load_neighbors(models), load_scorer(models),
+                      load_rating_indexes(root), load_genre_index(genres, self.ratings, root))
+        (self.catalog, self.boards, self.count, self.content_index, self.neighbor_index, self.scorer,
+         self.rating_indexes, self.genre_index) = loaded
+
+    def popular(self, genre=leaderboard.ALL, num=5):
+
+        # TMDb ids and popularity of a random selection from the leaderboard of a genre
+
+        with metrics.timer('popular.sample'):
+            rows = leaderboard.sample(self.boards, genre, num)
+        table = self.catalog.table
+        return {'genre': genre, 'ids': table['tmdbId'].values[rows].tolist(), 'scores': table['popularity'].values[rows].tolist()}
+
+    def _genres(self, row):
+
+        # Genre names of a contents title, in the same format descTitle returns
+
+        ids = self._links[self._links['tmdbId'] == self.content_ids[row]]['movieId']
+        names = self.genre_index.genres_of(ids.to_numpy(dtype=np.int64))
+        return ' '.join(names) if names else None
+
+    def resolve(self, title):
+
+        # Contents titles are answered from the catalog, other titles are described by TMDb.
+        # Search and details are raced by the client, the overview alone is used when the
+        # details miss their deadline
+
+        row = self._rows.get(title.strip().lower())
+        if row is not None and self.neighbor_index is not None and row < len(self.neighbor_index):
+            metrics.count('content.catalog_titles')
+            return Query(self.titles[row], row=row, genres=self._genres(row))
+        metrics.count('content.tmdb_titles')
+        try:
+            with metrics.timer('content.tmdb_describe'):
+                results, details = self.tmdb.describe(title)
+            if details is not None:
+                title, doc, gList = descTitle(details)
+            else:
+                (title, doc), gList = overTitle(results[0]), None
+            return Query(title, doc=doc, genres=gList)
+        except Exception as e:
+            metrics.count('content.tmdb_errors')
+            return Query(title, error=str(e) or type(e).__name__)
+
+    def content_batch(self, queries, num):
+
+        # Content recommendations of resolved queries, the TMDb documents are featurized and scored together.
+        # Failed queries get popular movies and the title of the most popular movie for the collaborative step
+
+        results = [None] * len(queries)
+        docs = [i for i, q in enumerate(queries) if q.error is None and q.row is None]
+        if docs:
+            with metrics.timer('content.featurize'):
+                vectors = self.count.transform([queries[i].doc for i in docs])
+            with metrics.timer('content.similarity'):
+                inx, scores = self.content_index.query(vectors, num)
+            for i, ids, sc in zip(docs, inx, scores):
+                results[i] = (ids, sc)
+        res = []
+        for q, result in zip(queries, results):
+            if q.error is not None:
+                popular = self.popular(leaderboard.ALL, num)
+                res.append({'title': 'Avatar (2009)', 'genres': None, 'ids': popular['ids'], 'scores': popular['scores'], 'error': q.error})
+                continue
+            if q.row is not None:
+                with metrics.timer('content.neighbors'):
+                    result = self.neighbor_index.lookup(q.row, num)
+            ids, sc = result
+            res.append({'title': q.title, 'genres': q.genres, 'ids': self.content_ids[ids].tolist(), 'scores': np.asarray(sc, dtype=np.float64).tolist()})
+        return res
+
+    def users(self, title, n=100):
+
+        # Users who rated the title best, the most active users when it has no ratings
+
+        indexes = self.rating_indexes
+        try:
+            id = float(sorted(self.content_ids[self.titles == title])[0])
+            id = int(self._movies[id])
+            if indexes is not None:
+                userList = list(indexes[0].get(id)[0][:n])
+            else:
+                ratings = self.ratings()
+                userList = list(ratings[ratings['movieId'] == id].sort_values('rating', ascending=False)['userId'])[:n]
+            if not userList:
+                raise ValueError('No ratings for ' + title)
+        except (IndexError, KeyError, ValueError):
+            if indexes is not None:
+                userList = list(indexes[1].most_active(n))
+            else:
+                ratings = self.ratings()
+                mostUsers = ratings.iloc[:, :1].groupby('userId')['userId'].count().reset_index(name='count')
+                mostUsers = mostUsers.sort_values('count', ascending=False)
+                userList = list(mostUsers['userId'])[:n]
+        return userList
+
+    def candidates(self, title, gList):
+
+        # Candidate movies and users of a title, the deterministic part of the collaborative step.
+        # Candidates share any genre of the title and belong to the contents catalog, most rated first
+
+        def compute():
+            with metrics.timer('collaborative.candidates'):
+                movieIdx = list(self.genre_index.candidates(gList.split(' ') if gList else [], self.content_movies)[:1000])
+            with metrics.timer('collaborative.users'):
+                userList = self.users(title)
+            return {'movies': movieIdx, 'users': userList}
+
+        res = self.cached(result_cache.collaborative_key(title, gList), compute)
+        return res['movies'], res['users']
+
+    def collaborative_batch(self, queries, num, rng=random):
+
+        # Randomly selects users who rated each title and scores them against movies sharing its genres.
+        # The users and movies of all queries are scored as one block, every query then keeps the top
+        # num movies of each of its users. Returns the distinct movies, best score first
+
+        picks = []
+        for title, gList in queries:
+            movieIdx, userList = self.candidates(title, gList)
+            uList = rng.sample(userList, 10) if len(userList) > 10 else userList
+            mList = np.unique(rng.sample(movieIdx, min(100, len(movieIdx)))).astype(np.int64)
+            picks.append((np.asarray(uList, dtype=np.int64), mList))
+
+        users = np.unique(np.concatenate([u for u, _ in picks])) if picks else np.empty(0, dtype=np.int64)
+        items = np.unique(np.concatenate([m for _, m in picks])) if picks else np.empty(0, dtype=np.int64)
+        with metrics.timer('collaborative.svd_score'):
+            est = self.scorer.score(users, items)
+
+        res = []
+        for (title, _), (uList, mList) in zip(queries, picks):
+            with metrics.timer('collaborative.rank'):
+                block = est[np.ix_(np.searchsorted(users, uList), np.searchsorted(items, mList))]
+                order = np.argsort(-block, axis=1, kind='stable')[:, :num]
+                ids, scores = mList[order].ravel(), np.take_along_axis(block, order, axis=1).ravel()
+                best = np.argsort(-scores, kind='stable')
+                ids, scores = ids[best], scores[best]
+                _, first = np.unique(ids, return_index=True)
+                first.sort()
+                ids, scores = ids[first], scores[first]
+                rows = self.catalog.rows_by_movie(ids)
+                known = rows >= 0
+                res.append({'title': title, 'movieIds': ids[known].tolist(), 'ids': self.catalog.table['tmdbId'].values[rows[known]].tolist(),
+                            'scores': scores[known].tolist()})
+        return res
+
+    def cached(self, key, compute):
+
+        # The cached result of key, otherwise computes and caches it unless it failed or the
+        # models were reloaded while it was computed
+
+        res = self.results.get(key, 'results_' + key[0])
+        if res is None:
+            generation = self.results.generation
+            res = compute()
+            if res.get('error') is None:
+                self.results.put(key, res, generation)
+        return res
+
+    def content(self, title, num=5):
+        return self.cached(result_cache.content_key(title, num), lambda: self.content_batch([self.resolve(title)], num)[0])
+
+    def collaborative(self, title, genres=None, num=5):
+        return self.collaborative_batch([(title, genres)], num)[0]
@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+import configparser
+from collections import OrderedDict
+from utils import metrics
+
+# Process-wide cache of recommendation results
+# Ranked ids and scores (never rendered rows, so the callers still sample from them) are kept
+# under the kind of recommendation, the normalized title and the parameters, with LRU eviction
+# beyond maxsize entries and a TTL. The whole cache is dropped when one of the artifacts it was
+# filled from changes on disk, checked at most every check_interval seconds, and on_change is
+# called so the owner reloads them. Only deterministic results belong here: the collaborative
+# step caches its candidate movies and users, not the random sample it scores from them
+
+MAXSIZE = 1024
+TTL = 3600
+
+
+def read_config(filename='env.config'):
+
+    # Cache settings from env.config, the [Results] section is optional
+
+    config = configparser.ConfigParser()
+    config.read(filename)
+    return {
+        'maxsize': config.getint('Results', 'maxsize', fallback=MAXSIZE),
+        'ttl': config.getfloat('Results', 'ttl_seconds', fallback=TTL),
+    }
+
+
+def fingerprint(paths):
+
+    # Size and modification time of every artifact, a missing file counts as part of it
+
+    res = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            res.append((path, stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            res.append((path, None, None))
+    return tuple(res)
+
+
+def normalize(title):
+    return ' '.join(title.split()).lower()
+
+
+def content_key(title, num):
+    return ('content', normalize(title), num)
+
+
+def collaborative_key(title, genres):
+    return ('collaborative', normalize(title), genres)
+
+
+class ResultCache:
+
+    def __init__(self, maxsize=MAXSIZE, ttl=TTL, paths=(), check_interval=5.0, on_change=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.paths = list(paths)
+        self.check_interval = check_interval
+        self.on_change = on_change
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.generation = 0                                           # Bumped whenever the entries are dropped for a change
+        self._entries = OrderedDict()                                 # key -> (stored, value), least recently used first
+        self._lock = threading.Lock()
+        self._fingerprint = fingerprint(paths)
+        self._checked = time.monotonic()
+
+    def _check(self, now):
+
+        # Drops everything once the artifacts changed, returns the previous fingerprint then
+
+        if now - self._checked < self.check_interval:
+            return None
+        self._checked = now
+        current = fingerprint(self.paths)
+        if current == self._fingerprint:
+            return None
+        previous, self._fingerprint = self._fingerprint, current
+        self._entries.clear()
+        self.generation += 1
+        self.invalidations += 1
+        return previous
+
+    def _changed(self, previous):
+
+        # Runs on_change outside the lock, only in the thread that saw the change, then drops what
+        # other threads cached from the old artifacts meanwhile and starts a new generation. When it fails the previous
+        # fingerprint is restored so the next check tries again
+
+        try:
+            self.on_change()
+        except Exception:
+            with self._lock:
+                self._fingerprint = previous
+            raise
+        else:
+            with self._lock:
+                self._fingerprint = fingerprint(self.paths)           # on_change may have republished artifacts itself
+        finally:
+            with self._lock:
+                self._entries.clear()
+                self.generation += 1
+
+    def get(self, key, kind='results'):
+
+        # The cached value of key, None on a miss
+
+        now = time.monotonic()
+        with self._lock:
+            previous = self._check(now)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if previous is not None and self.on_change is not None:
+            self._changed(previous)
+        metrics.cache(kind, entry is not None)
+        return None if entry is None else entry[1]
+
+    def put(self, key, value, generation=None):
+
+        # Stores value unless the artifacts changed since generation was read, i.e. it may have
+        # been computed from the old models
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions,
+                'expirations': self.expirations, 'invalidations': self.invalidations}
@@ -0,0 +1,169 @@
+import argparse
+import numpy as np
+from utils import store
+
+# Vectorized scoring for the SVD collaborative recommender
+# The factors and biases of a trained surprise SVD are pulled into numpy arrays, so a whole
+# users x items block is scored with one matrix product instead of one predict() per pair.
+# Estimates follow SVD.predict: biases of unknown users/items are left out, the dot product
+# only applies when both are known, and the result is clipped to the rating scale.
+# Models are exported as raw arrays plus a versioned meta.json header, so serving processes
+# open them memory-mapped and share the pages instead of unpickling the surprise dump
+
+MODEL_ROOT = './systems'
+MODEL_NAME = 'svd'
+MODEL_VERSION = 1
+
+
+class IdMap:
+
+    # Raw id -> inner id mapping kept as a sorted array, looked up with a binary search
+
+    def __init__(self, raw, inner):
+        self.raw = raw
+        self.inner = inner
+
+    @classmethod
+    def from_dict(cls, mapping):
+        try:
+            raw = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+        except (TypeError, ValueError):
+            raise ValueError('Only integer raw ids are supported')
+        inner = np.fromiter(mapping.values(), dtype=np.int32, count=len(mapping))
+        order = np.argsort(raw, kind='stable')
+        return cls(raw[order], inner[order])
+
+    def __len__(self):
+        return len(self.raw)
+
+    def lookup(self, ids):
+
+        # Returns the inner ids, -1 for ids unknown to the model
+
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if len(self.raw) == 0:
+            return np.full(len(ids), -1, dtype=np.int32)
+        pos = np.minimum(np.searchsorted(self.raw, ids), len(self.raw) - 1)
+        return np.where(self.raw[pos] == ids, self.inner[pos], -1).astype(np.int32)
+
+
+class SVDScorer:
+
+    def __init__(self, pu, qi, bu, bi, global_mean, rating_scale, biased, users, items):
+        self.pu = pu
+        self.qi = qi
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = float(global_mean)
+        self.rating_scale = tuple(rating_scale)
+        self.biased = bool(biased)
+        self.users = users
+        self.items = items
+
+    @classmethod
+    def from_algo(cls, algo):
+        trainset = algo.trainset
+        return cls(np.asarray(algo.pu), np.asarray(algo.qi), np.asarray(algo.bu), np.asarray(algo.bi),
+                   trainset.global_mean, trainset.rating_scale, algo.biased,
+                   IdMap.from_dict(trainset._raw2inner_id_users), IdMap.from_dict(trainset._raw2inner_id_items))
+
+    @classmethod
+    def load(cls, root=MODEL_ROOT, name=MODEL_NAME):
+        meta = store.read_meta(name, root)
+        if meta.get('model') != 'svd' or meta.get('model_version') != MODEL_VERSION:
+            raise ValueError('Unsupported model artifact ' + store.table_path(name, root))
+        arrays = store.open_table(name, root)
+        return cls(arrays['pu'], arrays['qi'], arrays['bu'], arrays['bi'], meta['global_mean'], meta['rating_scale'], meta['biased'],
+                   IdMap(arrays['user_raw'], arrays['user_inner']), IdMap(arrays['item_raw'], arrays['item_inner']))
+
+    def save(self, root=MODEL_ROOT, name=MODEL_NAME, meta=None):
+        arrays = {
+            'pu': self.pu, 'qi': self.qi, 'bu': self.bu, 'bi': self.bi,
+            'user_raw': self.users.raw, 'user_inner': self.users.inner,
+            'item_raw': self.items.raw, 'item_inner': self.items.inner,
+        }
+        info = {
+            'model': 'svd', 'model_version': MODEL_VERSION, 'global_mean': self.global_mean,
+            'rating_scale': list(self.rating_scale), 'biased': self.biased, 'n_factors': int(self.pu.shape[1]),
+            **(meta or {}),
+        }
+        return store.write_arrays(name, arrays, info, root)
+
+    def score(self, users, items):
+
+        # Estimated ratings of every raw user id (rows) for every raw item id (columns)
+
+        u = self.users.lookup(users)
+        i = self.items.lookup(items)
+        known_u, known_i = u >= 0, i >= 0
+        est = np.full((len(u), len(i)), self.global_mean)
+        if self.biased:
+            est += np.where(known_u, self.bu[u], 0)[:, None]
+            est += np.where(known_i, self.bi[i], 0)[None, :]
+            est[np.ix_(known_u, known_i)] += self.pu[u[known_u]] @ self.qi[i[known_i]].T
+        else:
+            # Without biases, predictions for unknown ids fall back to the global mean
+            est[np.ix_(known_u, known_i)] = self.pu[u[known_u]] @ self.qi[i[known_i]].T
+        return np.clip(est, *self.rating_scale)
+
+    def predict(self, users, items):
+
+        # Estimated ratings of (user, item) pairs, with the same rules as score
+
+        u = self.users.lookup(users)
+        i = self.items.lookup(items)
+        known_u, known_i = u >= 0, i >= 0
+        est = np.full(len(u), self.global_mean)
+        both = known_u & known_i
+        dot = np.einsum('ij,ij->i', self.pu[u[both]], self.qi[i[both]])
+        if self.biased:
+            est += np.where(known_u, self.bu[u], 0) + np.where(known_i, self.bi[i], 0)
+            est[both] += dot
+        else:
+            est[both] = dot
+        return np.clip(est, *self.rating_scale)
+
+    def top(self, users, items, k):
+
+        # Returns the k best items per user and their estimates, ties keep the order of items
+
+        items = np.asarray(items)
+        est = self.score(users, items)
+        order = np.argsort(-est, axis=1, kind='stable')[:, :k]
+        return items[order], np.take_along_axis(est, order, axis=1)
+
+
+def verify(algo, scorer, samples=200, seed=0):
+
+    # Compares the scorer against algo.predict on random known and unknown ids, returns the
+    # largest absolute difference and whether every per-user ranking also orders predict()
+    # (ties closer than the summation noise of the matrix product count as equal)
+
+    rng = np.random.default_rng(seed)
+    users = rng.choice(scorer.users.raw, min(samples, len(scorer.users)), replace=False)
+    items = rng.choice(scorer.items.raw, min(samples, len(scorer.items)), replace=False)
+    users = np.append(users, scorer.users.raw.max() + 1)
+    items = np.append(items, scorer.items.raw.max() + 1)
+    est = scorer.score(users, items)
+    expected = np.array([[algo.predict(int(u), int(i)).est for i in items] for u in users])
+    order = np.argsort(-est, axis=1, kind='stable')
+    same = bool(np.all(np.diff(np.take_along_axis(expected, order, axis=1), axis=1) <= 1e-9))
+    return float(np.abs(est - expected).max()), same
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports the surprise SVD pickle as memory-mappable factor arrays.')
+    parser.add_argument('--pickle', default='./systems/svd.pkl')
+    parser.add_argument('--root', default=MODEL_ROOT)
+    parser.add_argument('--name', default=MODEL_NAME)
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+
+    from surprise import dump
+
+    _, algo = dump.load(args.pickle)
+    SVDScorer.from_algo(algo).save(args.root, args.name)
+    diff, same = verify(algo, SVDScorer.load(args.root, args.name), args.samples)
+    print('Exported', store.table_path(args.name, args.root), '- max difference to predict():', diff, '- rankings identical:', same)
+    if diff > 1e-9 or not same:
+        raise SystemExit('Round-trip check against ' + args.pickle + ' failed')
@@ -0,0 +1,284 @@
+import json
+import time
+import queue
+import argparse
+import threading
+import configparser
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer
+from http.server import BaseHTTPRequestHandler
+from utils import metrics
+from utils import leaderboard
+from utils import result_cache
+
+# Headless HTTP/JSON recommendation service
+# Loads a Recommender (see utils/recommend.py) once and answers
+#   GET /popular?genre=All&num=5
+#   GET /content?title=...&num=5
+#   GET /collaborative?title=...&genres=...&num=5
+#   GET /recommend?title=...&num=5         content, then collaborative on the resolved title
+#   GET /metrics                            stage latencies and counters in the Prometheus format
+# with TMDb ids and scores. Every request is resolved on its own thread, while the scoring
+# of concurrent requests is coalesced by a Batcher into one batched call per model.
+# Run it with 'python -m utils.service' and set url in the [Service] section of env.config
+# for the Recommend page to call it instead of loading the models itself
+
+HOST = '127.0.0.1'
+PORT = 8601
+
+
+def read_config(filename='env.config'):
+
+    # Service settings from env.config, the [Service] section is optional
+
+    config = configparser.ConfigParser()
+    config.read(filename)
+    return {
+        'host': config.get('Service', 'host', fallback=HOST),
+        'port': config.getint('Service', 'port', fallback=PORT),
+        'url': config.get('Service', 'url', fallback='') or None,
+        'max_batch': config.getint('Service', 'max_batch', fallback=32),
+        'max_wait': config.getfloat('Service', 'max_wait_ms', fallback=5) / 1000,
+    }
+
+
+class Batcher:
+
+    # Coalesces concurrent submissions into one call of fn on the list of their items.
+    # A batch is closed after max_batch items or max_wait seconds after its first item, when
+    # the call fails its items are retried one by one
+
+    def __init__(self, fn, max_batch=32, max_wait=0.005, name='batch'):
+        self.fn = fn
+        self.name = name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.batches += 1
+            self.items += len(batch)
+            metrics.count('service.' + self.name + '_batches')
+            metrics.count('service.' + self.name + '_requests', len(batch))
+            try:
+                with metrics.timer('service.' + self.name + '_batch'):
+                    results = self.fn([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._retry(batch)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _retry(self, batch):
+
+        # A failed batch is called again item by item, so only the items failing on their own get an error
+
+        metrics.count('service.' + self.name + '_retries', len(batch))
+        for item, future in batch:
+            try:
+                future.set_result(self.fn([item])[0])
+            except Exception as e:
+                future.set_exception(e)
+
+
+def _by_num(items, fn):
+
+    # Calls fn(queries, num) once per distinct num of the (query, num) items, results in item order
+
+    res = [None] * len(items)
+    for num in set(num for _, num in items):
+        picked = [i for i, (_, n) in enumerate(items) if n == num]
+        for i, result in zip(picked, fn([items[i][0] for i in picked], num)):
+            res[i] = result
+    return res
+
+
+class Service:
+
+    def __init__(self, recommender, max_batch=32, max_wait=0.005):
+        self.recommender = recommender
+        self.content_batcher = Batcher(lambda items: _by_num(items, recommender.content_batch), max_batch, max_wait, 'content')
+        self.collaborative_batcher = Batcher(lambda items: _by_num(items, recommender.collaborative_batch), max_batch, max_wait, 'collaborative')
+
+    def popular(self, genre=leaderboard.ALL, num=5):
+        return self.recommender.popular(genre, num)
+
+    def content(self, title, num=5):
+
+        # Cached results skip both the TMDb lookup and the batch
+
+        return self.recommender.cached(result_cache.content_key(title, num),
+                                       lambda: self.content_batcher.submit((self.recommender.resolve(title), num)))
+
+    def collaborative(self, title, genres=None, num=5):
+        return self.collaborative_batcher.submit(((title, genres), num))
+
+    def recommend(self, title, num=5):
+        content = self.content(title, num)
+        return {'content': content, 'collaborative': self.collaborative(content['title'], content['genres'], num)}
+
+    def stats(self):
+        res = {name: {'batches': b.batches, 'requests': b.items}
+               for name, b in (('content', self.content_batcher), ('collaborative', self.collaborative_batcher))}
+        res['results'] = self.recommender.results.stats()
+        return res
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    service = None
+
+    def _send(self, status, body, content_type='application/json'):
+        data = body.encode('utf-8') if isinstance(body, str) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        try:
+            num = int(params.get('num', 5))
+            if num < 1:
+                raise ValueError('num must be positive')
+            if url.path == '/metrics':
+                return self._send(200, metrics.REGISTRY.prometheus(), 'text/plain; version=0.0.4')
+            if url.path == '/health':
+                return self._send(200, {'status': 'ok', 'batches': self.service.stats()})
+            if url.path == '/popular':
+                return self._send(200, self.service.popular(params.get('genre', leaderboard.ALL), num))
+            if url.path not in ('/content', '/collaborative', '/recommend'):
+                return self._send(404, {'error': 'Unknown path ' + url.path})
+            title = params.get('title', '').strip()
+            if not title:
+                raise ValueError('Missing title')
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        try:
+            with metrics.timer('service' + url.path):
+                if url.path == '/content':
+                    body = self.service.content(title, num)
+                elif url.path == '/collaborative':
+                    body = self.service.collaborative(title, params.get('genres') or None, num)
+                else:
+                    body = self.service.recommend(title, num)
+            return self._send(200, body)
+        except Exception as e:
+            metrics.count('service.errors')
+            return self._send(500, {'error': str(e) or type(e).__name__})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(service, host=HOST, port=PORT):
+    handler = type('BoundHandler', (Handler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class ServiceError(Exception):
+    pass
+
+
+class Client:
+
+    # Same interface as the Recommender, answered by a running service. A service that is down,
+    # times out or answers with an error status raises ServiceError
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _get(self, path, **params):
+        query = urllib.parse.urlencode({key: value for key, value in params.items() if value is not None})
+        try:
+            with urllib.request.urlopen(self.url + path + '?' + query, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except (urllib.error.URLError, TimeoutError, OSError, ValueError) as e:
+            raise ServiceError('Recommendation service failed on ' + path + ': ' + str(e)) from e
+
+    def popular(self, genre=leaderboard.ALL, num=5):
+        return self._get('/popular', genre=genre, num=num)
+
+    def content(self, title, num=5):
+        return self._get('/content', title=title, num=num)
+
+    def collaborative(self, title, genres=None, num=5):
+        return self._get('/collaborative', title=title, genres=genres, num=num)
+
+
+def load(config='env.config'):
+
+    # Recommender over the prebuilt artifacts, with the same fallbacks as the pages
+
+    from utils import datasets
+    from utils import store
+    from utils import shared
+    from utils import recommend
+    from utils.catalog import Catalog
+    from utils.catalog import CATALOG_FILE
+
+    roots = shared.attach(config)
+    try:
+        catalog = Catalog.attach(roots['store'])
+    except FileNotFoundError:
+        try:
+            catalog = Catalog.load(CATALOG_FILE)
+        except FileNotFoundError:
+            catalog = Catalog.build(datasets.read('desc_movies'), datasets.read('desc2_movies'), datasets.read('posters'), datasets.read('links'))
+    genres = datasets.read('genres')
+    try:
+        boards = leaderboard.load(catalog, roots['store'] + '/leaderboards.pkl')
+    except FileNotFoundError:
+        boards = leaderboard.build(catalog, genres)
+    return recommend.Recommender.load(catalog, boards, datasets.read('contents'), datasets.read('links', ['movieId', 'tmdbId']), genres,
+                                      lambda: store.load_ratings('./data/ratings.csv', roots['store']), config, roots['models'], roots['store'])
+
+
+if __name__ == '__main__':
+    settings = read_config()
+    parser = argparse.ArgumentParser(description='Serves the popularity, content and collaborative recommenders over HTTP/JSON.')
+    parser.add_argument('--config', default='env.config')
+    parser.add_argument('--host', default=settings['host'])
+    parser.add_argument('--port', type=int, default=settings['port'])
+    parser.add_argument('--max-batch', type=int, default=settings['max_batch'])
+    parser.add_argument('--max-wait-ms', type=float, default=settings['max_wait'] * 1000)
+    args = parser.parse_args()
+
+    service = Service(load(args.config), args.max_batch, args.max_wait_ms / 1000)
+    server = serve(service, args.host, args.port)
+    print('Serving recommendations on http://' + args.host + ':' + str(server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
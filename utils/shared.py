@@ -0,0 +1,193 @@
+import os
+import json
+import shutil
+import argparse
+import configparser
+from utils import store
+
+# Host-wide copies of the serving artifacts for multi-worker deployments
+# The columnar tables (ratings, rating and genre indexes, token tables, graph, SVD factors,
+# featurizer) are copied once into a shared root, by default in /dev/shm, and the catalog,
+# count matrix and content neighbors are converted into mappable tables on the way. Every
+# worker then maps the same files read-only, so the pages are shared by all processes and
+# a new worker only opens files. Publishing is skipped for sources unchanged since the last
+# run and serialized with a file lock, so only the first worker of a host does the work
+
+SHARED_DIR = '/dev/shm/movie_recommender'
+STORE_ROOT = store.STORE_DIR
+MODEL_ROOT = './systems'
+
+STORE_TABLES = ['ratings', 'ratings_by_movie', 'ratings_by_user', 'movie_genres', 'casts', 'keywords', 'trailers', 'coappearance']
+MODEL_TABLES = ['svd', 'count']
+
+
+def read_config(filename='env.config'):
+
+    # Shared root from env.config, the [Shared] section is optional and disabled by default
+
+    config = configparser.ConfigParser()
+    config.read(filename)
+    return {
+        'enabled': config.getboolean('Shared', 'enabled', fallback=False),
+        'root': config.get('Shared', 'root', fallback='') or SHARED_DIR,
+    }
+
+
+def roots(root=None):
+
+    # Store and model roots the loaders read from, the local ones when nothing is shared
+
+    if root is None:
+        return {'store': STORE_ROOT, 'models': MODEL_ROOT}
+    return {'store': os.path.join(root, 'store'), 'models': os.path.join(root, 'systems')}
+
+
+def _signature(path):
+
+    # Size and modification time of a file or of the meta.json of a table, None when missing
+
+    if os.path.isdir(path):
+        path = os.path.join(path, 'meta.json')
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _copy_table(source, target):
+    tmp = target + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.copytree(source, tmp)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.replace(tmp, target)
+
+
+def _copy_file(source, target):
+    tmp = target + '.tmp'
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+
+
+def _catalog(source, target):
+    from utils.catalog import Catalog
+    Catalog.load(source).save_table(os.path.dirname(target), os.path.basename(target))
+
+
+def _content(source, target):
+    from utils.similarity import ContentIndex
+    ContentIndex.load(source).save(os.path.dirname(target), os.path.basename(target))
+
+
+def _neighbors(source, target):
+    from utils.neighbors import NeighborIndex
+    NeighborIndex.load(source).save(os.path.dirname(target), os.path.basename(target))
+
+
+def sources(store_root=STORE_ROOT, model_root=MODEL_ROOT):
+
+    # (name, source, writer) of every published artifact, names are the paths under the shared root
+
+    res = [('store/' + name, os.path.join(store_root, name), _copy_table) for name in STORE_TABLES]
+    res += [('systems/' + name, os.path.join(model_root, name), _copy_table) for name in MODEL_TABLES]
+    res += [
+        ('store/leaderboards.pkl', os.path.join(store_root, 'leaderboards.pkl'), _copy_file),
+        ('store/catalog', os.path.join(store_root, 'catalog.pkl'), _catalog),
+        ('systems/content', os.path.join(model_root, 'count_matrix.npz'), _content),
+        ('systems/neighbors', os.path.join(model_root, 'neighbors.npz'), _neighbors),
+    ]
+    return res
+
+
+def _read_manifest(root):
+    try:
+        with open(os.path.join(root, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def publish(root=SHARED_DIR, store_root=STORE_ROOT, model_root=MODEL_ROOT, force=False):
+
+    # Brings the shared copies up to date with their sources, returns the names that were written.
+    # Missing sources are skipped, their loaders keep falling back as without a shared root
+
+    manifest = _read_manifest(root)
+    written = []
+    for name, source, writer in sources(store_root, model_root):
+        signature = _signature(source)
+        target = os.path.join(root, name)
+        if signature is None or (not force and manifest.get(name) == signature and os.path.exists(target)):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        writer(source, target)
+        manifest[name] = signature
+        written.append(name)
+    tmp = os.path.join(root, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(root, 'manifest.json'))
+    return written
+
+
+def _publish_locked(root):
+
+    # Publishes under an exclusive lock so concurrent workers wait for the first one instead of
+    # converting in parallel, the others then find nothing changed
+
+    import fcntl
+
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            return publish(root)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def refresh(config='env.config'):
+
+    # Republishes the sources changed since the last run when sharing is enabled, e.g. after the
+    # offline tools rewrote them under the local roots. Returns the names that were written
+
+    settings = read_config(config)
+    if not settings['enabled']:
+        return []
+    return _publish_locked(settings['root'])
+
+
+def attach(config='env.config'):
+
+    # Roots of this process: the shared ones when enabled, brought up to date first
+
+    settings = read_config(config)
+    if not settings['enabled']:
+        return roots()
+    _publish_locked(settings['root'])
+    return roots(settings['root'])
+
+
+def remove(root=SHARED_DIR):
+
+    # Frees the shared memory, running workers keep their mapped files until they exit
+
+    shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    settings = read_config()
+    parser = argparse.ArgumentParser(description='Publishes the serving artifacts into shared memory for every worker of the host.')
+    parser.add_argument('command', choices=['publish', 'remove'])
+    parser.add_argument('--root', default=settings['root'])
+    parser.add_argument('--force', action='store_true', help='republishes unchanged artifacts')
+    args = parser.parse_args()
+
+    if args.command == 'remove':
+        remove(args.root)
+        print('Removed', args.root)
+    else:
+        os.makedirs(args.root, exist_ok=True)
+        written = publish(args.root, force=args.force)
+        print('Published', len(written), 'artifacts to', args.root + (': ' + ', '.join(written) if written else ''))
@@ -0,0 +1,86 @@
+import numpy as np
+from scipy import sparse
+from utils import store
+
+# Content similarity engine
+# Rows of the count matrix are L2-normalized once, so cosine similarity becomes a plain
+# sparse dot product, and the matrix is kept transposed (term -> titles) so a query only
+# touches the postings of the terms it contains. The normalized matrix can be saved in the
+# columnar store and mapped read-only, e.g. once per host in shared memory (see utils/shared.py)
+
+CONTENT_ROOT = './systems'
+CONTENT_NAME = 'content'
+CONTENT_VERSION = 1
+
+
+def normalize_rows(matrix, dtype=np.float32):
+    matrix = sparse.csr_matrix(matrix, dtype=dtype)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+
+def topk(scores, k):
+
+    # Partial selection of the k best columns per row, only the selected ones are sorted
+
+    scores = np.atleast_2d(np.asarray(scores))
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(scores.dtype)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_scores, order, axis=1)
+
+
+class ContentIndex:
+
+    def __init__(self, terms):
+        self.terms = terms                                            # Normalized titles x terms matrix, transposed
+        self.shape = (terms.shape[1], terms.shape[0])
+
+    @classmethod
+    def build(cls, matrix):
+        return cls(normalize_rows(matrix).T.tocsr())
+
+    @classmethod
+    def load(cls, filename='./systems/count_matrix.npz'):
+        return cls.build(sparse.load_npz(filename))
+
+    @classmethod
+    def attach(cls, root=CONTENT_ROOT, name=CONTENT_NAME):
+
+        # Maps the normalized matrix written by save, nothing is normalized or copied
+
+        meta = store.read_meta(name, root)
+        if meta.get('model') != 'content' or meta.get('model_version') != CONTENT_VERSION:
+            raise ValueError('Unsupported content index artifact ' + store.table_path(name, root))
+        arrays = store.open_table(name, root)
+        return cls(sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(meta['shape']), copy=False))
+
+    def save(self, root=CONTENT_ROOT, name=CONTENT_NAME):
+        arrays = {'data': self.terms.data, 'indices': self.terms.indices, 'indptr': self.terms.indptr}
+        meta = {'model': 'content', 'model_version': CONTENT_VERSION, 'shape': list(self.terms.shape)}
+        return store.write_arrays(name, arrays, meta, root)
+
+    @property
+    def matrix(self):
+
+        # Normalized titles x terms view, without copying
+
+        return self.terms.T
+
+    def scores(self, vectors):
+
+        # Cosine similarity of every query vector against every title
+
+        queries = normalize_rows(vectors)
+        return (queries @ self.terms).toarray()
+
+    def query(self, vectors, k):
+
+        # Returns the indices and similarities of the k most similar titles per query vector
+
+        return topk(self.scores(vectors), k)
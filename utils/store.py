@@ -0,0 +1,177 @@
+import os
+import json
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+
+# Columnar store for the large MovieLens tables
+# Every table is a directory holding one .npy file per column plus a meta.json,
+# so that the serving side can open each column memory-mapped
+
+STORE_DIR = './data/store'
+STORE_VERSION = 1
+
+# Compact dtypes for the ratings table (ratings are half-stars, exact in float32)
+RATINGS_SCHEMA = {
+    'userId': np.int32,
+    'movieId': np.int32,
+    'rating': np.float32,
+    'timestamp': np.int32,
+}
+
+
+def table_path(name, root=STORE_DIR):
+    return os.path.join(root, name)
+
+
+def has_table(name, root=STORE_DIR):
+    return os.path.exists(os.path.join(table_path(name, root), 'meta.json'))
+
+
+def read_meta(name, root=STORE_DIR):
+    with open(os.path.join(table_path(name, root), 'meta.json')) as f:
+        return json.load(f)
+
+
+def _publish(tmp, path):
+
+    # Swaps a fully written table directory into place, readers that still
+    # have the old files mapped keep them until they are closed. The old table is
+    # moved aside first, so the table is only missing between two renames
+
+    old = path + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def write_arrays(name, arrays, meta=None, root=STORE_DIR):
+
+    # Writes a dict of arrays of any length, e.g. the offsets and values of an index
+
+    path = table_path(name, root)
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for col, values in arrays.items():
+        np.save(os.path.join(tmp, col + '.npy'), np.ascontiguousarray(values))
+    info = {'version': STORE_VERSION, 'columns': list(arrays)}
+    info.update(meta or {})
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(info, f, indent=2)
+    _publish(tmp, path)
+    return info
+
+
+def write_table(name, columns, meta=None, root=STORE_DIR):
+
+    # Writes a dict of equally long arrays as a table
+
+    rows = None
+    for col, values in columns.items():
+        if rows is not None and len(values) != rows:
+            raise ValueError('Column ' + col + ' has ' + str(len(values)) + ' rows, expected ' + str(rows))
+        rows = len(values)
+    info = {'rows': rows or 0}
+    info.update(meta or {})
+    return write_arrays(name, columns, info, root)
+
+
+def open_table(name, root=STORE_DIR, columns=None):
+
+    # Opens the columns of a table read-only and memory-mapped
+
+    meta = read_meta(name, root)
+    if meta.get('version') != STORE_VERSION:
+        raise ValueError('Unsupported store version for ' + name + ': ' + str(meta.get('version')))
+    path = table_path(name, root)
+    return {col: np.load(os.path.join(path, col + '.npy'), mmap_mode='r') for col in (columns or meta['columns'])}
+
+
+def encode_strings(strings):
+
+    # Fixed-width UTF-8 array of strings, mappable unlike an object array
+
+    return np.array([s.encode('utf-8') for s in strings], dtype=bytes) if len(strings) else np.array([], dtype='S1')
+
+
+def decode_strings(values):
+    return [s.decode('utf-8') for s in values.tolist()]
+
+
+def to_frame(table):
+
+    # Wraps the mapped columns in a DataFrame without copying them
+
+    return pd.DataFrame({col: np.asarray(values) for col, values in table.items()}, copy=False)
+
+
+def _count_rows(filename, blocksize=1 << 24):
+    lines, last = 0, b'\n'
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return lines - 1
+
+
+def ingest_csv(filename, name, schema, root=STORE_DIR, chunksize=1_000_000):
+
+    # Converts a csv into a table chunk by chunk, so memory stays bounded by the chunksize
+
+    rows = _count_rows(filename)
+    path = table_path(name, root)
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    columns = {col: np.lib.format.open_memmap(os.path.join(tmp, col + '.npy'), mode='w+', dtype=dtype, shape=(rows,))
+               for col, dtype in schema.items()}
+    filled = 0
+    for chunk in pd.read_csv(filename, usecols=list(schema), dtype=schema, chunksize=chunksize):
+        n = len(chunk)
+        if filled + n > rows:
+            raise ValueError(filename + ' has more rows than counted')
+        for col, values in columns.items():
+            values[filled:filled + n] = chunk[col].to_numpy()
+        filled += n
+    if filled != rows:
+        raise ValueError(filename + ' has ' + str(filled) + ' rows, expected ' + str(rows))
+    for values in columns.values():
+        values.flush()
+    del columns
+
+    stat = os.stat(filename)
+    info = {'version': STORE_VERSION, 'rows': rows, 'columns': list(schema),
+            'source': os.path.abspath(filename), 'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(info, f, indent=2)
+    _publish(tmp, path)
+    return info
+
+
+def load_ratings(filename='./data/ratings.csv', root=STORE_DIR):
+
+    # Serves ratings from the mapped store, falling back to parsing the csv with compact dtypes
+
+    if has_table('ratings', root):
+        return to_frame(open_table('ratings', root))
+    return pd.read_csv(filename, dtype=RATINGS_SCHEMA)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts the MovieLens ratings csv into the memory-mapped columnar store.')
+    parser.add_argument('--ratings', default='./data/ratings.csv')
+    parser.add_argument('--root', default=STORE_DIR)
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    info = ingest_csv(args.ratings, 'ratings', RATINGS_SCHEMA, root=args.root, chunksize=args.chunksize)
+    print('Ingested', info['rows'], 'ratings into', table_path('ratings', args.root))
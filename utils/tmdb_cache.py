@@ -0,0 +1,185 @@
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import configparser
+from utils import metrics
+from utils.tmdb_client import API_URL
+from utils.tmdb_client import AsyncTMDb
+from utils.tmdb_client import BackgroundClient
+
+# Persistent cache for TMDb lookups
+# Search results are keyed by the normalized query title and details by TMDb id, both stored
+# as JSON in SQLite with the time they were fetched. Entries older than the TTL are refetched,
+# while in offline mode only the cache is used (stale entries included) and misses raise
+# LookupError, so tests and air-gapped deployments run without the API.
+# Misses are fetched with the pooled asynchronous client (see utils/tmdb_client.py)
+
+CACHE_FILE = './data/tmdb_cache.sqlite'
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+def normalize(title):
+    return re.sub(r'\s+', ' ', title).strip().lower()
+
+
+def read_config(filename='env.config'):
+
+    # API key and cache settings from env.config, the [TMDb] section is optional
+
+    config = configparser.ConfigParser()
+    config.read(filename)
+    return {
+        'api_key': config.get('APIKey', 'API_KEY', fallback=None),
+        'filename': config.get('TMDb', 'cache', fallback=CACHE_FILE),
+        'ttl': config.getfloat('TMDb', 'ttl_days', fallback=DEFAULT_TTL / 86400) * 86400,
+        'offline': config.getboolean('TMDb', 'offline', fallback=False),
+        'url': config.get('TMDb', 'url', fallback=API_URL),
+        'timeout': config.getfloat('TMDb', 'timeout', fallback=3.0),
+        'concurrency': config.getint('TMDb', 'concurrency', fallback=8),
+    }
+
+
+class TMDbCache:
+
+    def __init__(self, filename=CACHE_FILE, ttl=DEFAULT_TTL, offline=False, api_key=None, language='en',
+                 url=API_URL, timeout=3.0, concurrency=8):
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._settings = {'api_key': api_key, 'url': url, 'language': language, 'timeout': timeout, 'concurrency': concurrency}
+        self.language = language
+        self._background = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS search (query TEXT PRIMARY KEY, results TEXT NOT NULL, fetched REAL NOT NULL)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS details (id INTEGER PRIMARY KEY, movie TEXT NOT NULL, fetched REAL NOT NULL)')
+
+    def _client(self):
+        if self._background is None:
+            self._background = BackgroundClient(AsyncTMDb(**self._settings))
+        return self._background
+
+    def _run(self, call):
+        background = self._client()
+        with metrics.timer('tmdb.fetch'):
+            return background.run(call(background.client))
+
+    def _get(self, table, column, key, value):
+
+        # Cached value, or None when missing or (unless offline) expired
+
+        with self._lock:
+            row = self._conn.execute('SELECT ' + column + ', fetched FROM ' + table + ' WHERE ' + key + ' = ?', (value,)).fetchone()
+        if row is None or (not self.offline and time.time() - row[1] > self.ttl):
+            self.misses += 1
+            metrics.cache('tmdb_' + table, False)
+            return None
+        self.hits += 1
+        metrics.cache('tmdb_' + table, True)
+        return json.loads(row[0])
+
+    def _put(self, table, value, data):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO ' + table + ' VALUES (?, ?, ?)', (value, json.dumps(data), time.time()))
+
+    def _key(self, title):
+        return self.language + '|' + normalize(title)
+
+    def search(self, title):
+
+        # Search results as a list of {id, title, overview}, best match first
+
+        results = self._get('search', 'results', 'query', self._key(title))
+        if results is None:
+            if self.offline:
+                raise LookupError('No cached TMDb search for ' + title)
+            results = self._run(lambda client: client.hedged(lambda: client.search(title)))
+            self._put('search', self._key(title), results)
+        return results
+
+    def details(self, id):
+
+        # Title, overview and the genre, cast and keyword names of a movie
+
+        movie = self._get('details', 'movie', 'id', int(id))
+        if movie is None:
+            if self.offline:
+                raise LookupError('No cached TMDb details for ' + str(id))
+            movie = self._run(lambda client: client.hedged(lambda: client.details(id)))
+            self._put('details', int(id), movie)
+        return movie
+
+    def describe(self, title):
+
+        # Search results and details of the best match, the details are None when only the
+        # overview could be served (offline miss, or details not fetched in time)
+
+        results = self._get('search', 'results', 'query', self._key(title))
+        if results:
+            details = self._get('details', 'movie', 'id', int(results[0]['id']))
+            if details is not None or self.offline:
+                return results, details
+        elif self.offline:
+            raise LookupError('No cached TMDb search for ' + title)
+        fetched, details = self._run(lambda client: client.describe(title, results))
+        self._store(title, results, fetched, details)
+        return fetched, details
+
+    def _store(self, title, cached, results, details):
+        if cached is None:
+            self._put('search', self._key(title), results)
+        if details is not None:
+            self._put('details', int(details['id']), details)
+
+    def prefetch(self, titles, details=True, batch=64):
+
+        # Warms the cache for a list of titles in concurrent batches, returns the number of titles that failed
+
+        failed = 0
+        titles = [title for title in titles if self._get('search', 'results', 'query', self._key(title)) is None]
+        for start in range(0, len(titles), batch):
+            chunk = titles[start:start + batch]
+            if details:
+                described = self._run(lambda client: client.describe_many(chunk))
+            else:
+                described = self._run(lambda client: client.search_many(chunk))
+                described = [r if isinstance(r, BaseException) else (r, None) for r in described]
+            for title, result in zip(chunk, described):
+                if isinstance(result, BaseException):
+                    failed += 1
+                    continue
+                self._store(title, None, *result)
+                if details and result[1] is None:
+                    failed += 1
+        return failed
+
+    def close(self):
+        if self._background is not None:
+            self._background.close()
+        self._conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prefetches TMDb search results and details for the whole catalog.')
+    parser.add_argument('command', choices=['prefetch'])
+    parser.add_argument('--titles', default='./data/contents.csv', help='csv with a title column, years in parentheses are stripped')
+    parser.add_argument('--config', default='env.config')
+    parser.add_argument('--no-details', action='store_true')
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    settings = read_config(args.config)
+    cache = TMDbCache(settings['filename'], settings['ttl'], False, settings['api_key'],
+                      url=settings['url'], timeout=settings['timeout'], concurrency=settings['concurrency'])
+    titles = pd.read_csv(args.titles, usecols=['title'], lineterminator='\n')['title'].dropna()
+    titles = titles.str.replace(r'\s*\(\d{4}\)$', '', regex=True).unique()
+    start = time.time()
+    failed = cache.prefetch(titles, not args.no_details)
+    cache.close()
+    print('Prefetched', len(titles) - failed, 'of', len(titles), 'titles into', settings['filename'], 'in', round(time.time() - start, 1), 's')
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+
+# Asynchronous TMDb client
+# One pooled aiohttp session is reused for every call, each request has its own deadline and
+# a bounded number of retries, and a semaphore caps the requests in flight. describe() races
+# the lookups of a title: a slow search is hedged with a duplicate request, and when the
+# details do not arrive in time the overview-only search result is returned instead.
+# aiohttp is imported when the first session opens, lookups answered by the cache never load it
+
+API_URL = 'https://api.themoviedb.org/3'
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TMDbError(Exception):
+    pass
+
+
+def _search_result(r):
+    return {'id': r['id'], 'title': r.get('title', ''), 'overview': r.get('overview') or ''}
+
+
+def _details_result(r):
+    return {
+        'id': r['id'],
+        'title': r.get('title', ''),
+        'overview': r.get('overview') or '',
+        'genres': [i['name'] for i in r.get('genres', [])],
+        'casts': [i['name'] for i in r.get('casts', {}).get('cast', [])],
+        'keywords': [i['name'] for i in r.get('keywords', {}).get('keywords', [])],
+    }
+
+
+class AsyncTMDb:
+
+    def __init__(self, api_key, url=API_URL, language='en', timeout=3.0, concurrency=8, retries=2, backoff=0.2, hedge_delay=0.5,
+                 details_deadline=None):
+        self.api_key = api_key
+        self.url = url.rstrip('/')
+        self.language = language
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_delay = hedge_delay
+        self.details_deadline = timeout if details_deadline is None else details_deadline
+        self._session = None
+        self._semaphore = None
+        self._errors = (asyncio.TimeoutError, TMDbError)             # Retried errors, aiohttp.ClientError is added on open
+
+    async def open(self):
+        if self._session is None:
+            import aiohttp
+            self._errors = (asyncio.TimeoutError, aiohttp.ClientError, TMDbError)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            connector = aiohttp.TCPConnector(limit=self.concurrency, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, path, params):
+        async with self._session.get(self.url + path, params=params) as resp:
+            if resp.status in RETRY_STATUS:
+                raise TMDbError('TMDb responded ' + str(resp.status) + ' for ' + path)
+            if resp.status != 200:
+                raise LookupError('TMDb responded ' + str(resp.status) + ' for ' + path)
+            return await resp.json()
+
+    async def get(self, path, **params):
+
+        # One API call under the concurrency limit, retried on timeouts and transient errors
+
+        await self.open()
+        params = dict(params, api_key=self.api_key, language=self.language)
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    return await asyncio.wait_for(self._request(path, params), self.timeout)
+            except self._errors:
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def search(self, title):
+
+        # Search results as a list of {id, title, overview}, best match first
+
+        return [_search_result(r) for r in (await self.get('/search/movie', query=title))['results']]
+
+    async def details(self, id):
+
+        # Title, overview and the genre, cast and keyword names of a movie
+
+        return _details_result(await self.get('/movie/' + str(int(id)), append_to_response='casts,keywords'))
+
+    async def hedged(self, make):
+
+        # Starts a second identical call when the first is slower than hedge_delay, first success wins
+
+        first = asyncio.ensure_future(make())
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        if done:
+            return first.result()
+        second = asyncio.ensure_future(make())
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def describe(self, title, search=None):
+
+        # Returns (search result, details or None), details missing their deadline fall back to the overview
+
+        results = search if search is not None else await self.hedged(lambda: self.search(title))
+        if not results:
+            raise LookupError('No TMDb results for ' + title)
+        try:
+            details = await asyncio.wait_for(self.hedged(lambda: self.details(results[0]['id'])), self.details_deadline)
+        except self._errors + (LookupError,):
+            details = None
+        return results, details
+
+    async def search_many(self, titles):
+
+        # Batched search() for prefetch jobs, failures are returned in place of results
+
+        return await asyncio.gather(*(self.search(title) for title in titles), return_exceptions=True)
+
+    async def describe_many(self, titles):
+
+        # Batched describe() for prefetch jobs, failures are returned in place of results
+
+        return await asyncio.gather(*(self.describe(title) for title in titles), return_exceptions=True)
+
+
+class BackgroundClient:
+
+    # Runs an AsyncTMDb on a private event loop thread, so synchronous code such as Streamlit
+    # reruns shares one pooled session across calls
+
+    def __init__(self, client):
+        self.client = client
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='tmdb-client', daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def close(self):
+        self.run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
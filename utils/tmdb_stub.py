@@ -0,0 +1,101 @@
+import json
+import zlib
+import random
+import asyncio
+import sqlite3
+import argparse
+from aiohttp import web
+
+# Local stub of the TMDb endpoints used by utils/tmdb_client.py
+# Serves /3/search/movie and /3/movie/{id} with configurable latency, jitter and error rate,
+# answering from a TMDb cache file when one is given and with deterministic fake movies
+# otherwise, so the client's timeouts, retries and hedging can be exercised offline.
+# Point the [TMDb] url in env.config at http://127.0.0.1:<port>/3 to use it
+
+
+class StubTMDb:
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, cache=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._conn = sqlite3.connect(cache) if cache else None
+
+    def _fake(self, id):
+        return {
+            'id': id,
+            'title': 'Movie ' + str(id),
+            'overview': 'Overview of movie ' + str(id),
+            'genres': [{'name': 'Drama'}],
+            'casts': {'cast': [{'name': 'Actor ' + str(id % 97)}, {'name': 'Actor ' + str(id % 89)}]},
+            'keywords': {'keywords': [{'name': 'keyword' + str(id % 13)}]},
+        }
+
+    def _cached(self, table, column, key, value):
+        if self._conn is None:
+            return None
+        row = self._conn.execute('SELECT ' + column + ' FROM ' + table + ' WHERE ' + key + ' = ?', (value,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def _delay(self):
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if self._random.random() < self.error_rate:
+            raise web.HTTPServiceUnavailable()
+
+    async def search(self, request):
+        await self._delay()
+        query = request.query.get('query', '')
+        results = self._cached('search', 'results', 'query', request.query.get('language', 'en') + '|' + ' '.join(query.lower().split()))
+        if results is None:
+            results = [{'id': zlib.crc32(query.lower().encode()) % 1000000, 'title': query, 'overview': 'Overview of ' + query}]
+        return web.json_response({'page': 1, 'results': results, 'total_results': len(results)})
+
+    async def details(self, request):
+        await self._delay()
+        id = int(request.match_info['id'])
+        movie = self._cached('details', 'movie', 'id', id)
+        if movie is None:
+            return web.json_response(self._fake(id))
+        return web.json_response({
+            'id': movie['id'],
+            'title': movie['title'],
+            'overview': movie['overview'],
+            'genres': [{'name': i} for i in movie['genres']],
+            'casts': {'cast': [{'name': i} for i in movie['casts']]},
+            'keywords': {'keywords': [{'name': i} for i in movie['keywords']]},
+        })
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/3/search/movie', self.search)
+        app.router.add_get('/3/movie/{id}', self.details)
+        return app
+
+
+async def start(stub, host='127.0.0.1', port=0):
+
+    # Starts the stub in the running loop, returns the runner and its base url
+
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, 'http://' + host + ':' + str(port) + '/3'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a local stub of the TMDb API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--cache', default=None, help='TMDb cache file to answer from')
+    args = parser.parse_args()
+
+    stub = StubTMDb(args.latency, args.jitter, args.error_rate, args.cache)
+    web.run_app(stub.app(), host=args.host, port=args.port)
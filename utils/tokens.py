@@ -0,0 +1,158 @@
+import ast
+import argparse
+import numpy as np
+from utils import store
+
+# Normalized token tables of the stringified list and dict columns
+# casts and keywords hold Python list literals and trailers dict literals. They are parsed once
+# into long format tables of (movie id, position, token id) sorted by movie, with the token
+# strings interned in a vocabulary and persisted in the columnar store, so counts and per movie
+# lookups are array operations instead of literal_eval or string splitting on every rerun
+
+# Token table -> (dataset, column), movie ids are the TMDb ids in the movieId column
+SOURCES = {
+    'casts': ('desc_movies', 'casts'),
+    'keywords': ('desc2_movies', 'keywords'),
+    'trailers': ('trailers', 'trailers'),
+}
+
+
+def parse(value):
+
+    # Items of a list literal or (key, value) pairs of a dict literal, nothing for missing or malformed values
+
+    if not isinstance(value, str) or not value:
+        return []
+    try:
+        parsed = ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return []
+    if isinstance(parsed, dict):
+        return list(parsed.items())
+    if isinstance(parsed, (list, tuple)):
+        return list(parsed)
+    return []
+
+
+class TokenTable:
+
+    def __init__(self, movie_ids, positions, tokens, vocab, values=None):
+        self.movie_ids = movie_ids
+        self.positions = positions
+        self.tokens = tokens
+        self.vocab = vocab
+        self.values = values                                          # Dict values, aligned with tokens
+        self.ids, starts = np.unique(movie_ids, return_index=True)
+        self.indptr = np.append(starts, len(movie_ids)).astype(np.int64)
+
+    @classmethod
+    def build(cls, movie_ids, docs):
+
+        # Parses one literal per movie, repeated movie ids keep their first document
+
+        interned, seen = {}, set()
+        movies, positions, tokens, values = [], [], [], []
+        for movie, doc in zip(movie_ids, docs):
+            if movie != movie or movie in seen:
+                continue
+            seen.add(movie)
+            for pos, item in enumerate(parse(doc)):
+                value = None
+                if isinstance(item, tuple):
+                    item, value = item
+                movies.append(movie)
+                positions.append(pos)
+                tokens.append(interned.setdefault(str(item), len(interned)))
+                values.append(value)
+        movies = np.asarray(movies, dtype=np.int64)
+        order = np.argsort(movies, kind='stable')
+        if all(v is None for v in values):
+            values = None
+        else:
+            values = [str(values[i]) if values[i] is not None else '' for i in order]
+        return cls(movies[order], np.asarray(positions, dtype=np.int32)[order],
+                   np.asarray(tokens, dtype=np.int32)[order], list(interned), values)
+
+    @classmethod
+    def load(cls, name, root=store.STORE_DIR):
+        arrays = store.open_table(name, root)
+        values = store.decode_strings(arrays['values']) if 'values' in arrays else None
+        return cls(arrays['movie_ids'], arrays['positions'], arrays['tokens'], store.decode_strings(arrays['vocab']), values)
+
+    def save(self, name, root=store.STORE_DIR):
+        arrays = {'movie_ids': self.movie_ids, 'positions': self.positions, 'tokens': self.tokens, 'vocab': store.encode_strings(self.vocab)}
+        if self.values is not None:
+            arrays['values'] = store.encode_strings(self.values)
+        return store.write_arrays(name, arrays, {'rows': len(self.tokens), 'movies': len(self.ids), 'vocab': len(self.vocab)}, root)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _slice(self, movie_id):
+        i = np.searchsorted(self.ids, movie_id)
+        if i == len(self.ids) or self.ids[i] != movie_id:
+            return slice(0, 0)
+        return slice(self.indptr[i], self.indptr[i + 1])
+
+    def get(self, movie_id):
+
+        # Tokens of a movie in their original order, empty for unknown movies
+
+        return [self.vocab[t] for t in self.tokens[self._slice(movie_id)].tolist()]
+
+    def items(self, movie_id):
+
+        # (key, value) pairs of a movie for tables parsed from dict literals
+
+        rows = self._slice(movie_id)
+        return list(zip(self.get(movie_id), self.values[rows]))
+
+    def counts(self, movie_ids=None):
+
+        # Occurrences of every token, optionally only within the given movies
+
+        tokens = self.tokens
+        if movie_ids is not None:
+            tokens = tokens[np.isin(self.movie_ids, np.asarray(movie_ids, dtype=np.int64))]
+        return np.bincount(tokens, minlength=len(self.vocab))
+
+    def top(self, n, movie_ids=None):
+
+        # The n most frequent tokens and their counts, ties in vocabulary order
+
+        counts = self.counts(movie_ids)
+        top = np.argsort(-counts, kind='stable')[:n]
+        top = top[counts[top] > 0]
+        return [self.vocab[i] for i in top.tolist()], counts[top]
+
+    def leads(self):
+
+        # For every movie with at least two tokens, its first token repeated against each of the others
+
+        sizes = np.diff(self.indptr)
+        entries = np.repeat(np.arange(len(self.ids)), sizes)
+        first = self.indptr[:-1][entries]
+        rest = np.arange(len(self.tokens)) != first
+        return self.tokens[first[rest]], self.tokens[rest]
+
+
+def build(name, read):
+
+    # Token table of one of the SOURCES, read is the dataset reader, e.g. utils.datasets.read
+
+    dataset, column = SOURCES[name]
+    frame = read(dataset, ['movieId', column])
+    return TokenTable.build(frame['movieId'].tolist(), frame[column].tolist())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parses the list and dict literal columns into token tables.')
+    parser.add_argument('names', nargs='*', default=list(SOURCES))
+    parser.add_argument('--root', default=store.STORE_DIR)
+    args = parser.parse_args()
+
+    from utils import datasets
+
+    for name in args.names:
+        info = build(name, datasets.read).save(name, args.root)
+        print('Saved', info['rows'], name, 'of', info['movies'], 'movies with', info['vocab'], 'distinct tokens to', store.table_path(name, args.root))